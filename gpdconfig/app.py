@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 
+import os
 import sys
+import datetime
+import atexit
+import signal
 import argparse
+import importlib
 
 sys.tracebacklimit = 0
 
@@ -9,22 +14,289 @@ sys.tracebacklimit = 0
 try:
     from wincontrols import WinControls, defaults
     from wincontrols.config import KeyCodes
+    from wincontrols.polling import PollStrategy, RetryPolicy
 except:
     from .wincontrols import WinControls, defaults
     from .wincontrols.config import KeyCodes
+    from .wincontrols.polling import PollStrategy, RetryPolicy
+
+# the package holding the wincontrols modules, however we were run
+_package = WinControls.__module__.rpartition('.')[0]
+
+def load(name):
+    """Import a wincontrols feature module when it's first needed, so e.g. --keys starts quickly"""
+    return importlib.import_module(f"{_package}.{name}")
+
+def openBackend(options):
+    """Return the device backend selected on the command line (None for hidapi)"""
+    if options.replay:
+        return load('trace').Replay(options.replay, timing=options.replaytiming)
+    if options.backend == "simulator":
+        return load('simulator').Simulator(count=options.simcount, latency=options.simlatency/1000, notReady=options.simnotready,
+                         errorRate=options.simerrors)
+    if options.backend == "hidraw":
+        return load('hidraw')
+    return None
+
+def openLibrary(options, required=True):
+    """Return the ProfileStore of --library, or None if it doesn't exist and isn't required"""
+    library = load('library')
+    directory = options.library or library.defaultLibraryDir()
+    if not os.path.isdir(directory):
+        if required:
+            raise RuntimeError(f"Profile library {directory} not found")
+        return None
+    return library.ProfileStore(directory)
+
+def readConfigLines(options):
+    """Collect the config lines from --reset, --set and the command line, in the order they apply"""
+    config = []
+    if options.reset:
+        config.extend(defaults.split("\n"))
+    elif options.set:
+        with open(options.set, 'r') as rf:
+            config.extend(rf.readlines())
+    config.extend(options.config)
+    return config
+
+def runFleetCommand(options, backend, poll, retry, lockTimeout=None, metrics=None, journal=None):
+    """Read, check or write every attached controller"""
+    config = readConfigLines(options)
+    # applied straight from the compiled image, with any config lines on top
+    image = openLibrary(options).image(options.profile) if options.profile else None
+    operation = 'verify' if options.check else 'write' if config or image else 'read'
+    results, elapsed = load('fleet').runFleet(operation, config, image=image, backend=backend, paths=options.device, serials=options.serial,
+                                workers=options.jobs, force=options.force, verify=options.verify, disableFwCheck=options.fwcheck, poll=poll, retry=retry,
+                                lockTimeout=lockTimeout, metrics=metrics, journal=journal)
+
+    failed = 0
+    for result in results:
+        name = f"{result['path'].decode()} ({result['serial']})"
+        if result['error']:
+            status = f"error: {result['error']}"
+        elif operation == 'verify':
+            status = "matches" if result['ok'] else f"differs in {', '.join(c[0] for c in result['changes'])}"
+        elif operation == 'write':
+            status = f"wrote {len(result['changes'])} changes" if result['written'] else "unchanged"
+        else:
+            status = "read"
+        failed += not result['ok']
+        retries = sum(result.get('retries', {}).values())
+        print(f"{name}: {status} [{result['elapsed']*1000:.1f}ms{f', {retries} retries' if retries else ''}]")
+        if options.verbose and 'config' in result:
+            print(result['config'])
+
+    busy = sum(r['elapsed'] for r in results)
+    print(f"{len(results)} controllers, {failed} failed, {elapsed*1000:.1f}ms wall clock ({busy/elapsed:.1f}x parallel)")
+    if failed:
+        sys.exit(1)
+
+def printChanges(changes, written):
+    if written:
+        for name, old, new in changes:
+            print(f"{name}: {old} -> {new}")
+    else:
+        print("Config unchanged, not writing")
+
+def printHistory(history):
+    for entry in history:
+        stamp = datetime.datetime.fromtimestamp(entry['time']).isoformat(sep=' ', timespec='seconds')
+        print(f"{'*' if entry['current'] else ' '}{entry['seq']:>6}  {stamp}  {entry['firmware']}")
+
+def runClient(client, options):
+    """Carry out the requested operations through a running daemon"""
+    if options.history:
+        printHistory(client.request("history")['history'])
+        return
+
+    if options.rollback is not None:
+        state = client.request("rollback", ref=options.rollback, force=options.force, verify=options.verify)
+        printChanges(state['changes'], state['written'])
+        return
+
+    if options.dumpraw:
+        sys.stdout.buffer.write(bytes.fromhex(client.request("raw")['raw']))
+        return
+
+    state = client.request("get")
+
+    if options.dump:
+        with open(options.dump,"w") as wf:
+            wf.write(state['config'])
+
+    config = []
+    if options.set:
+        with open(options.set, 'r') as rf:
+            config.extend(rf.readlines())
+    config.extend(options.config)
+
+    # one request for everything, so the device is only written once
+    if options.profile:
+        state = client.request("apply", name=options.profile, config=config, force=options.force, verify=options.verify)
+        printChanges(state['changes'], state['written'])
+
+    elif options.reset or config:
+        state = client.request("set", config=config, reset=options.reset, force=options.force, verify=options.verify)
+        printChanges(state['changes'], state['written'])
+
+    if options.verbose:
+        print(state['config'])
+
+def runMonitor(options, backend):
+    """Stream input events from the controller until interrupted"""
+    serial = options.serial[0] if options.serial else None
+    monitor = load('monitor')
+    interfaces = monitor.inputInterfaces(backend, serial)
+    broadcaster = monitor.Broadcaster(options.monitorsocket) if options.monitorsocket else None
+    outputs = [] if broadcaster and options.quiet else [sys.stdout]
+    if broadcaster:
+        outputs.append(broadcaster)
+
+    mon = None
+    try:
+        mon = monitor.Monitor(interfaces, backend, outputs)
+        signal.signal(signal.SIGTERM, lambda signum, frame: mon.stop.set())
+        mon.run(options.monitorduration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if broadcaster:
+            broadcaster.close()
+
+    if mon is None:
+        return
+    stats = mon.stats()
+    latency = f", latency p50 {stats['p50']:.0f}us p99 {stats['p99']:.0f}us max {stats['max']:.0f}us" if 'p50' in stats else ""
+    print(f"{stats['reports']} reports, {stats['events']} events, {stats['overruns']} dropped in {stats['elapsed']:.1f}s{latency}", file=sys.stderr)
+
+def runDirect(wc, options):
+    """Carry out the requested operations on an open controller whose config has been read"""
+    if options.history or options.rollback is not None:
+        server = load('daemon').Dispatcher(wc)
+        if options.history:
+            printHistory(server.dispatch({'cmd': 'history'})['history'])
+        else:
+            state = server.dispatch({'cmd': 'rollback', 'ref': options.rollback, 'force': options.force, 'verify': options.verify})
+            printChanges(state['changes'], state['written'])
+        return
+
+    if wc.loaded and options.dump:
+        with open(options.dump,"w") as wf:
+            wf.write(wc.dump())
+
+    # gather every config source first so the device is only written once
+    modified = False
+    if options.reset:
+        modified = wc.setConfig(defaults)
+
+    elif wc.loaded and options.set:
+        with open(options.set, 'r') as rf:
+            modified = wc.setConfig(rf.readlines())
+
+    elif wc.loaded and options.profile:
+        wc.loadImage(openLibrary(options).image(options.profile))
+        modified = True
+
+    # parse any additional arguments as configuration lines
+    if options.config:
+        modified = wc.setConfig(options.config) or modified
+
+    if modified and options.check:
+        changes = wc.diff()
+        for name, old, new in changes:
+            print(f"{name}: {old} (expected {new})")
+        if changes:
+            sys.exit(1)
+
+    elif modified:
+        changes = wc.diff()
+        printChanges(changes, wc.writeConfig(force=options.force, verify=options.verify))
+
+    if options.verbose:
+        # dump configuration to stdout
+        print(wc.dump())
 
 def main():
     parser = argparse.ArgumentParser(
         description = "Configures the mouse-mode controls on GPD Win devices. Replaces the official GPD WinControls app.",
     )
 
-    parser.add_argument("-s","--set", metavar="FILE", help="Read config from FILE",)
+    # the config to start from; field=value arguments apply on top of it
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("-s","--set", metavar="FILE", help="Read config from FILE",)
     parser.add_argument("-d","--dump", metavar="FILE", help="Dump config to FILE")
-    parser.add_argument("-r","--reset", action="store_true", help="Reset to defaults")
+    source.add_argument("-r","--reset", action="store_true", help="Reset to defaults")
     parser.add_argument("-v","--verbose", action="store_true", help="Output current config to stdout")
+    parser.add_argument("-F","--force", action="store_true", help="Write config even if it is unchanged")
     parser.add_argument("-x","--disable-version-check", dest="fwcheck", action="store_true", help="Disable FW version check")
     parser.add_argument("-o","--dump-raw", dest="dumpraw", action="store_true", help="Dump raw config data (DEBUG)")
 
+    parser.add_argument("--device", metavar="PATH", action="append", help="Use the controller with this HID path (may be repeated with --all)")
+    parser.add_argument("--serial", metavar="SERIAL", action="append", help="Use the controller with this serial number (may be repeated with --all)")
+    parser.add_argument("-a","--all", action="store_true", help="Apply to every attached controller in parallel")
+    parser.add_argument("--check", action="store_true", help="Check the controller already matches the given config instead of writing it")
+    parser.add_argument("-B","--batch", action="store_true", help="Run commands read from stdin on the controller, one per line, printing a JSON result for each; writes wait for a commit")
+    source.add_argument("-p","--profile", metavar="NAME", help="Apply the named profile from the profile library, compiled on top of the defaults: fields it leaves out are reset")
+    parser.add_argument("--library", metavar="DIR", help="Profile library directory (default: ~/.config/gpdconfig/profiles)")
+    parser.add_argument("--profiles", action="store_true", help="List the profiles in the profile library")
+    parser.add_argument("-W","--wait", metavar="SECS", type=float, help="Wait up to SECS for the controller to be attached, watching hotplug events")
+    parser.add_argument("--verify", choices=WinControls.verifyLevels, default="checksum", help="How to check a write: not at all, by the controller's checksum, or by reading the whole config back (default: checksum)")
+    parser.add_argument("--cache", action="store_true", help="Reuse the last read config if the device's checksum still matches it")
+    parser.add_argument("--cache-dir", dest="cachedir", metavar="DIR", help="Directory for --cache (default: $XDG_CACHE_HOME/gpdconfig)")
+    parser.add_argument("-b","--backend", choices=["hidapi","hidraw","simulator"], default="hidapi", help="Device backend to use: hidapi, direct Linux hidraw access, or a simulated controller (default: hidapi)")
+
+    group = parser.add_argument_group("Daemon options")
+    group.add_argument("--daemon", action="store_true", help="Run as a daemon holding the device open, serving requests on a unix socket")
+    group.add_argument("--socket", metavar="PATH", help="Daemon socket path (default: $XDG_RUNTIME_DIR/gpdconfig.sock)")
+    group.add_argument("--no-daemon", dest="nodaemon", action="store_true", help="Access the device directly even if a daemon is running")
+
+    group = parser.add_argument_group("Automatic profile options")
+    group.add_argument("--auto", metavar="RULES", help="Keep switching to the profile of the running application, as given in the RULES file")
+    group.add_argument("--auto-debounce", dest="autodebounce", metavar="SECS", type=float, default=1.0, help="Only switch once a profile has been wanted for SECS (default: 1)")
+    group.add_argument("--auto-interval", dest="autointerval", metavar="SECS", type=float, default=0.5, help="How often to check the running applications (default: 0.5)")
+
+    group = parser.add_argument_group("History options")
+    group.add_argument("--history", action="store_true", help="List the configs written to the controller, from the journal")
+    group.add_argument("--rollback", metavar="REF", help="Write a config back from the journal: a sequence number from --history, -N for N writes before the latest, or an ISO time")
+    group.add_argument("--journal", metavar="FILE", help="Journal of written configs (default: ~/.local/state/gpdconfig/journal)")
+    group.add_argument("--no-journal", dest="nojournal", action="store_true", help="Don't record written configs in the journal")
+
+    group = parser.add_argument_group("Locking options")
+    group.add_argument("--lock-timeout", dest="locktimeout", metavar="SECS", type=float, default=10, help="Wait up to SECS for another gpdconfig to finish with the controller (default: 10)")
+    group.add_argument("--no-lock", dest="nolock", action="store_true", help="Don't lock the controller against other gpdconfig processes")
+
+    group = parser.add_argument_group("Polling options")
+    group.add_argument("--poll-timeout", dest="polltimeout", metavar="SECS", type=float, default=5.0, help="Give up waiting for the controller to be ready after SECS (default: 5, 0 for no limit)")
+    group.add_argument("--poll-attempts", dest="pollattempts", metavar="N", type=int, help="Give up waiting for the controller to be ready after N polls")
+    group.add_argument("--poll-spin", dest="pollspin", metavar="N", type=int, default=8, help="Number of polls sent back to back before backing off (default: 8)")
+    group.add_argument("--poll-max-delay", dest="pollmaxdelay", metavar="MS", type=float, default=50, help="Longest delay between polls in milliseconds (default: 50)")
+    group.add_argument("--retries", metavar="N", type=int, default=3, help="Retry a read or write up to N times if its checksum doesn't match (default: 3)")
+    group.add_argument("--retry-budget", dest="retrybudget", metavar="N", type=int, default=10, help="Most retries made before successes earn more, so a bad link fails fast (default: 10)")
+    group.add_argument("--poll-stats", dest="pollstats", action="store_true", help="Report how long each readiness wait took")
+    group.add_argument("--metrics", metavar="FILE", help="Write request, wait, read and write metrics to FILE on exit (JSON if it ends in .json, otherwise Prometheus text)")
+
+    group = parser.add_argument_group("Tracing options")
+    group.add_argument("--trace", metavar="FILE", help="Record every HID request and reply to FILE as JSON lines")
+    group.add_argument("--replay", metavar="FILE", help="Replay a recorded trace instead of using a device")
+    group.add_argument("--replay-timing", dest="replaytiming", action="store_true", help="Reproduce the recorded latency of each transaction")
+
+    group = parser.add_argument_group("Simulator options")
+    group.add_argument("--sim-count", dest="simcount", metavar="N", type=int, default=1, help="Number of simulated controllers")
+    group.add_argument("--sim-latency", dest="simlatency", metavar="MS", type=float, default=0, help="Simulated latency per HID report in milliseconds")
+    group.add_argument("--sim-not-ready", dest="simnotready", metavar="N", type=int, default=0, help="Number of not-ready replies before the simulated controller is ready")
+    group.add_argument("--sim-errors", dest="simerrors", metavar="RATE", type=float, default=0, help="Chance of the simulated controller corrupting each block read or written")
+
+    group = parser.add_argument_group("Monitor options")
+    group.add_argument("-m","--monitor", action="store_true", help="Stream the controller's key, button and mouse events as JSON lines")
+    group.add_argument("--monitor-socket", dest="monitorsocket", metavar="PATH", help="Also stream events to clients of a unix socket at PATH")
+    group.add_argument("--monitor-duration", dest="monitorduration", metavar="SECS", type=float, help="Stop monitoring after SECS")
+    group.add_argument("-q","--quiet", action="store_true", help="Don't print monitored events to stdout (with --monitor-socket)")
+
+    group = parser.add_argument_group("Offline options")
+    group.add_argument("--compile", nargs=2, metavar=("SRC","DST"), help="Compile a profile or directory of profiles into raw config images without a device")
+    group.add_argument("--decompile", nargs=2, metavar=("SRC","DST"), help="Convert a raw config image or directory of .bin images back into profiles")
+    group.add_argument("-j","--jobs", type=int, help="Number of parallel workers for --compile/--decompile (default: one per CPU) and --all (default: one per controller)")
+
     group = parser.add_argument_group("Informational options")
     group.add_argument("-c","--fields", action="store_true", help="List available fields")
     group.add_argument("-f","--field-help", metavar="FIELD", help="Help for a specific field")
@@ -56,33 +328,135 @@ def main():
     if options.fields or options.keys:
         return
 
+    if options.profiles:
+        library = openLibrary(options)
+        for name in library.names():
+            print(f"{name:<24} {library.hash(name)[:12]}")
+        for name, error in sorted(library.errors.items()):
+            print(f"{name:<24} error: {error}")
+        return
+
+    if options.compile or options.decompile:
+        src, dst = options.compile or options.decompile
+        converted = failed = 0
+        for src, dst, error in load('compiler').convertTree(src, dst, decompile=bool(options.decompile), jobs=options.jobs):
+            if error:
+                print(f"{src}: {error}", file=sys.stderr)
+                failed += 1
+            else:
+                converted += 1
+        print(f"Converted {converted} files, {failed} failed")
+        if failed:
+            sys.exit(1)
+        return
+
+    if options.monitor:
+        runMonitor(options, openBackend(options))
+        return
+
+    direct = options.daemon or options.auto or options.nodaemon or options.all or options.device or options.serial or options.check or options.replay or options.trace or options.metrics or options.batch
+    if options.backend == "hidapi" and not direct:
+        client = load('daemon').connect(options.socket)
+        if client:
+            runClient(client, options)
+            return
+
+    backend = openBackend(options)
+    poll = PollStrategy(spin=options.pollspin, maxDelay=options.pollmaxdelay/1000,
+                        timeout=options.polltimeout, maxAttempts=options.pollattempts)
+    retry = RetryPolicy(retries=options.retries, budget=options.retrybudget)
+    tracer = load('trace').Tracer(options.trace) if options.trace else None
+    cache = load('cache').ConfigCache(options.cachedir) if options.cache else None
+    # the simulator and replays aren't hardware: don't lock, nor journal their writes unless asked to
+    emulated = bool(options.replay) or options.backend == "simulator"
+    lockTimeout = None if options.nolock or emulated else options.locktimeout
+    metrics = load('metrics').Metrics() if options.metrics else None
+    journal = None if options.nojournal or (emulated and not options.journal) else load('journal').Journal(options.journal)
+    if metrics:
+        atexit.register(metrics.writeTextfile, options.metrics)
+
+    # a specific controller, otherwise the first one found
+    path = options.device[0] if options.device else None
+    serial = options.serial[0] if options.serial else None
+
+    if options.wait is not None or options.daemon:
+        backend = load('hotplug').DeviceIndex(backend)
+        if options.wait is not None:
+            backend.wait(None if options.all else path, None if options.all else serial, options.wait)
+
+    if options.all:
+        runFleetCommand(options, backend, poll, retry, lockTimeout, metrics, journal)
+        return
+
     if options.dumpraw:
-        wc = WinControls(read=False,disableFwCheck=options.fwcheck)
+        wc = WinControls(read=False,disableFwCheck=options.fwcheck,backend=backend,poll=poll,path=path,serial=serial,tracer=tracer,
+                         lockTimeout=lockTimeout,metrics=metrics,retry=retry,journal=journal)
         if wc._readConfig():
             sys.stdout.buffer.write(wc._configRaw)
         return
        
-    # Read the current configuration from the device
-    wc = WinControls(disableFwCheck=options.fwcheck)
+    wc = WinControls(read=False,disableFwCheck=options.fwcheck,backend=backend,poll=poll,path=path,serial=serial,tracer=tracer,cache=cache,
+                     lockTimeout=lockTimeout,metrics=metrics,retry=retry,journal=journal)
 
-    if wc.loaded and options.dump:
-        with open(options.dump,"w") as wf:
-            wf.write(wc.dump())
+    if options.daemon:
+        wc.readConfig()
+        library = openLibrary(options, required=False)
+        server = load('daemon').Server(wc, options.socket, options.wait or 30, library, options.metrics)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            wc.close()
+        return
 
-    if options.reset:
-        if wc.setConfig(defaults):
-            wc.writeConfig()
+    if options.batch:
+        wc.readConfig()
+        library = openLibrary(options, required=False)
+        batch = load('batch').Batch(wc, options.wait or 0, library)
+        try:
+            pending = batch.run(sys.stdin, sys.stdout)
+        except KeyboardInterrupt:
+            pending = batch.pending()
+        finally:
+            wc.close()
+        print(f"{batch.commands} commands, {batch.failed} failed, {batch.commits} written", file=sys.stderr)
+        if pending:
+            print(f"Discarded {len(pending)} uncommitted changes", file=sys.stderr)
+        if batch.failed:
+            sys.exit(1)
+        return
 
-    elif wc.loaded and options.set:
-        with open(options.set, 'r') as rf:
-            if wc.setConfig(rf.readlines()):
-                wc.writeConfig()
+    if options.auto:
+        wc.readConfig()
+        autoprofile = load('autoprofile')
+        auto = autoprofile.AutoProfile(wc, autoprofile.ProfileRules.load(options.auto), debounce=options.autodebounce,
+                           interval=options.autointerval, log=print)
+        signal.signal(signal.SIGTERM, lambda signum, frame: auto.stop.set())
+        try:
+            auto.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            wc.close()
+        print(f"{auto.switches} profile changes written, {auto.skipped} already on the controller")
+        return
 
-    # parse any additional arguments as configuration lines
-    if options.config:
-        if wc.setConfig(options.config):
-            wc.writeConfig()
+    # hold the lock from reading to writing, so another gpdconfig's change in between isn't lost
+    with wc.transaction():
+        wc.readConfig()
+        runDirect(wc, options)
 
-    if options.verbose:
-        # dump configuration to stdout
-        print(wc.dump())
+    if options.pollstats:
+        for id, polls, elapsed, ready in wc.waitStats:
+            print(f"wait 0x{id:02x}: {polls} polls in {elapsed*1000:.2f}ms{'' if ready else ' (timed out)'}", file=sys.stderr)
+        if wc.lock and wc.lock.contended:
+            stats = wc.lock.stats()
+            print(f"lock: waited {stats['waitTotal']*1000:.2f}ms in total ({stats['contended']} of {stats['acquisitions']} contended), last held by pid {stats['lastHolder']}", file=sys.stderr)
+        if wc.retries:
+            print(f"retries: {', '.join(f'{cause} {count}' for cause, count in sorted(wc.retries.items()))}", file=sys.stderr)
+        if wc.writeTimes:
+            stages = ", ".join(f"{name} {secs*1000:.2f}ms" for name, secs in wc.writeTimes.items() if name != 'verify')
+            print(f"write ({wc.writeTimes['verify']} verification): {stages}", file=sys.stderr)
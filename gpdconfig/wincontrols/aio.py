@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import asyncio
+import functools
+import threading
+import concurrent.futures
+
+from .hardware import WinControls
+
+__all__ = ['AsyncWinControls']
+
+class AsyncWinControls:
+    """asyncio interface to a WinControls device.
+
+    Every blocking HID transaction runs on a worker thread dedicated to this
+    controller, so transactions on one device are serialised while separate
+    controllers proceed concurrently (e.g. with asyncio.gather). A timeout counts
+    from when the call starts running, not while it queues behind others. If a
+    queued call is cancelled it never runs; if a running one is cancelled or times
+    out, its pending readiness wait is aborted, and a write that hasn't been
+    committed yet is abandoned.
+    """
+
+    def __init__(self, wc, timeout=None, executor=None):
+        self.wc = wc
+        self.timeout = timeout
+        self._executor = executor or concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="wincontrols")
+        # token of the call running on the worker thread, so only that call's cancellation aborts it
+        self._current = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    async def open(cls, timeout=None, **kwargs):
+        """Open a controller, taking the same keyword arguments as WinControls"""
+        executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="wincontrols")
+        loop = asyncio.get_running_loop()
+        try:
+            wc = await asyncio.wait_for(loop.run_in_executor(executor, functools.partial(WinControls, **kwargs)), timeout)
+        except BaseException:
+            executor.shutdown(wait=False)
+            raise
+        return cls(wc, timeout, executor)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        await self.close()
+
+    def _job(self, token, started, function, args, kwargs):
+        with self._lock:
+            self._current = token
+            self.wc.abort.clear()
+        started()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._current = None
+
+    async def _run(self, function, *args, timeout=None, **kwargs):
+        loop = asyncio.get_running_loop()
+        token = object()
+        started = asyncio.Event()
+        job = self._executor.submit(self._job, token, functools.partial(loop.call_soon_threadsafe, started.set), function, args, kwargs)
+        try:
+            await started.wait()
+            return await asyncio.wait_for(asyncio.wrap_future(job), timeout if timeout is not None else self.timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            # a queued call is simply dropped; a running one can't be interrupted, but
+            # stop it polling a wedged device, unless it has finished meanwhile
+            if not job.cancel():
+                with self._lock:
+                    if self._current is token:
+                        self.wc.abort.set()
+            raise
+
+    async def readConfig(self, timeout=None):
+        """Read the current configuration from the device."""
+        return await self._run(self.wc.readConfig, timeout=timeout)
+
+    async def writeConfig(self, force=False, verify='checksum', timeout=None):
+        """Write the current configuration to the device. Returns False if it was skipped because nothing changed."""
+        return await self._run(self.wc.writeConfig, force=force, verify=verify, timeout=timeout)
+
+    async def setConfig(self, config):
+        """Update the configuration from a list or newline separated string of key=value pairs"""
+        return await self._run(self.wc.setConfig, config)
+
+    async def diff(self):
+        return await self._run(self.wc.diff)
+
+    async def dump(self):
+        """Return the current configuration as a string"""
+        return await self._run(self.wc.dump)
+
+    async def close(self):
+        """Close the device once any queued transactions have finished"""
+        try:
+            await self._run(self.wc.close)
+        finally:
+            self._executor.shutdown(wait=False)
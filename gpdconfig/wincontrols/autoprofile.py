@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import time
+import fnmatch
+import threading
+
+from .compiler import compileProfile
+from .hardware import deviceErrors
+
+__all__ = ['AutoProfile', 'ProfileRules', 'ProcSource']
+
+class ProcSource:
+    """Lists the executables of running processes by scanning /proc"""
+
+    def __init__(self, proc='/proc'):
+        self.proc = proc
+
+    def _name(self, pid):
+        try:
+            with open(os.path.join(self.proc, pid, 'cmdline'), 'rb') as rf:
+                argv0 = rf.read().split(b'\0', 1)[0].decode(errors='replace')
+        except OSError:
+            return None
+        # windows paths too, for games running under wine/proton
+        return re.split(r'[\\/]', argv0)[-1] or None
+
+    def snapshot(self):
+        """Return a dict of pid to executable name; kernel threads are left out"""
+        names = {}
+        for entry in os.listdir(self.proc):
+            if entry.isdigit():
+                name = self._name(entry)
+                if name:
+                    names[int(entry)] = name
+        return names
+
+class ProfileRules:
+    """Maps executable names to profiles, first matching rule wins.
+
+    Rules are case-insensitive glob patterns. Each profile is compiled on top of the
+    defaults once, when the rules are loaded. A rules file has one 'pattern = profile'
+    per line, where profile is a profile file or raw .bin image relative to the rules
+    file, and 'default' names the profile used when nothing matches:
+        # executable      profile
+        retroarch       = retroarch.txt
+        *witcher3*.exe  = witcher.txt
+        default         = desktop.txt
+    """
+
+    def __init__(self, rules=(), default=None):
+        # (pattern, name, image)
+        self.rules = [(re.compile(fnmatch.translate(pattern.lower())), name, image) for pattern, name, image in rules]
+        self.default = default
+
+    @staticmethod
+    def _load(path):
+        if path.endswith('.bin'):
+            with open(path, 'rb') as rf:
+                image = rf.read()
+            if len(image) != 256:
+                raise RuntimeError(f"{path}: config image must be 256 bytes, not {len(image)}")
+            return image
+        with open(path, 'r') as rf:
+            return bytes(compileProfile(rf.readlines()))
+
+    @classmethod
+    def load(cls, file):
+        base = os.path.dirname(os.path.abspath(file))
+        rules, default = [], None
+        with open(file, 'r') as rf:
+            for number, line in enumerate(rf, 1):
+                line = line.strip()
+                if line == "" or line.startswith("#"):
+                    continue
+                if "=" not in line:
+                    raise RuntimeError(f"{file}:{number}: invalid rule: {line}")
+                pattern, profile = (part.strip() for part in line.rsplit("=", 1))
+                image = cls._load(os.path.join(base, profile))
+                if pattern.lower() == 'default':
+                    default = (profile, image)
+                else:
+                    rules.append((pattern, profile, image))
+        return cls(rules, default)
+
+    def select(self, names):
+        """Return the (profile name, image) for a collection of running executables, or the default"""
+        names = [name.lower() for name in names]
+        for pattern, profile, image in self.rules:
+            if any(pattern.match(name) for name in names):
+                return profile, image
+        return self.default
+
+class AutoProfile:
+    """Switches the controller to the profile of the running application.
+
+    The running processes are checked every interval seconds. A new profile is only
+    written once it has been wanted for debounce seconds, so a burst of short-lived
+    processes (e.g. a game launcher) ends in at most one write, and nothing is written
+    if the controller already holds the profile's image. When no rule matches and the
+    rules have no default, the config the controller had at startup is restored. After
+    a device error, e.g. the controller was unplugged or the system resumed, it is
+    reopened before the next attempt.
+    """
+
+    def __init__(self, wc, rules, source=None, debounce=1.0, interval=0.5, log=None):
+        self.wc = wc
+        self.rules = rules
+        self.source = source or ProcSource()
+        self.debounce = debounce
+        self.interval = interval
+        self.log = log
+        self.stop = threading.Event()
+        self.startup = ('startup', bytes(wc._configRaw))
+        self.applied = None
+        # set after a device error, to reopen the controller before the next write
+        self.stale = False
+        # profile changes written to the controller
+        self.switches = 0
+        self.skipped = 0
+        self._pending = None
+        self._since = 0
+
+    def step(self, now=None):
+        """Check the running applications once. Returns True if a profile was written."""
+        now = time.monotonic() if now is None else now
+        target = self.rules.select(self.source.snapshot().values()) or self.startup
+        if target != self._pending:
+            self._pending, self._since = target, now
+        if self._pending == self.applied or now - self._since < self.debounce:
+            return False
+
+        try:
+            if self.stale:
+                self._reopen()
+            return self.apply(self._pending)
+        except (RuntimeError,) + deviceErrors() as e:
+            if not isinstance(e, RuntimeError):
+                self.stale = True
+            # try again after another debounce period
+            self._since = now
+            if self.log:
+                self.log(f"Failed to apply {self._pending[0]}: {e}")
+            return False
+
+    def _reopen(self):
+        self.wc.close()
+        self.wc._openHid()
+        self.wc.readConfig()
+        self.stale = False
+
+    def apply(self, target):
+        """Write a (profile name, image) to the controller unless it already holds it"""
+        name, image = target
+        if self.wc._configRaw is not None and bytes(self.wc._configRaw) == image:
+            self.skipped += 1
+            written = False
+        else:
+            self.wc.loadImage(image)
+            written = self.wc.writeConfig(force=True)
+            self.switches += written
+        self.applied = target
+        if self.log:
+            self.log(f"Switched to {name}" if written else f"Switched to {name} (already on the controller)")
+        return written
+
+    def run(self):
+        """Follow the running applications until stopped"""
+        while not self.stop.is_set():
+            self.step()
+            self.stop.wait(self.interval)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import json
+import time
+
+from .config import Config
+from .daemon import Dispatcher
+
+__all__ = ['Batch', 'parseCommand']
+
+# words of a text command that take a value rather than being a config line
+_options = ('verify', 'name', 'file', 'ref')
+# the word that may follow each text command on its own
+_positional = {'apply': 'name', 'dump': 'file', 'rollback': 'ref'}
+
+def parseCommand(line):
+    """Turn a line of input into a request: either a JSON object, or a command followed by words.
+
+    In the text form, field=value words are config lines, verify=, name=, file= and ref= set
+    those options, and any other bare word is a flag, e.g. "set a=M b=N", "commit
+    verify=readback" or "get refresh".
+    """
+    line = line.strip()
+    if line.startswith('{'):
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise RuntimeError("Request must be a JSON object")
+        return request
+
+    cmd, *words = line.split()
+    request = {'cmd': cmd}
+    config = []
+    for word in words:
+        key, sep, value = word.partition('=')
+        if not sep:
+            if cmd in _positional and _positional[cmd] not in request:
+                request[_positional[cmd]] = word
+            else:
+                request[word] = True
+        elif key in _options:
+            request[key] = value
+        else:
+            config.append(word)
+    if config:
+        request['config'] = config
+    return request
+
+class Batch(Dispatcher):
+    """Runs a stream of requests against one open WinControls, deferring writes until a commit.
+
+    Accepts the daemon's requests, but "set", "apply" and "rollback" only stage their changes;
+    they are written to the controller together by the next commit. Also:
+        {"cmd": "commit", "force": false, "verify": "checksum"}   write the staged changes
+        {"cmd": "discard"}                                          drop the staged changes
+        {"cmd": "check", "config": [...], "reset": false}         compare the controller with a config
+        {"cmd": "dump", "file": "..."}                              save the staged config to a file
+    """
+
+    def __init__(self, wc, wait=0, library=None):
+        super().__init__(wc, wait, library)
+        self.commands = 0
+        self.failed = 0
+        self.commits = 0
+
+    def _device(self):
+        """Return the config on the controller, as last read or written"""
+        if self.wc._configRaw is None:
+            raise RuntimeError("No config read from device")
+        return Config(bytes(self.wc._configRaw), self.wc._layout)
+
+    def pending(self):
+        """Return the staged changes not yet written, as (field, old, new) tuples"""
+        return self.wc.diff() if self.wc._configRaw is not None else None
+
+    def _state(self):
+        reply = super()._state()
+        reply['pending'] = self.pending()
+        return reply
+
+    def _refresh(self):
+        # reading replaces the config, so put any staged changes back on top of it
+        staged = self.wc.snapshot() if self.pending() != [] else None
+        super()._refresh()
+        if staged is not None:
+            self.wc.restore(staged)
+
+    def _set(self, config, reset=False, force=False, verify='checksum', image=None):
+        before = self.wc.snapshot()
+        try:
+            self._stage(config, reset, image)
+        except Exception:
+            self.wc.restore(before)
+            raise
+        return self._state()
+
+    def _commit(self, force=False, verify='checksum'):
+        with self.wc.transaction():
+            self._current()
+            changes = self.pending()
+            written = self.wc.writeConfig(force=force, verify=verify)
+        self.commits += written
+        reply = {'written': written, 'changes': changes or []}
+        if written:
+            reply['writeTimes'] = self.wc.writeTimes
+        return reply
+
+    def _check(self, config, reset=False):
+        self._current()
+        before = self.wc.snapshot()
+        try:
+            self._stage(config, reset)
+            expected = self.wc.snapshot()
+        finally:
+            self.wc.restore(before)
+        changes = expected.diff(self._device())
+        return {'matches': not changes, 'changes': changes}
+
+    def _dispatch(self, cmd, request):
+        if cmd == 'commit':
+            return self._commit(self._arg(request, 'force', bool, False), self._arg(request, 'verify', str, 'checksum'))
+        if cmd == 'discard':
+            discarded = self.pending()
+            self.wc.loadImage(self._device().image)
+            return {'discarded': discarded}
+        if cmd == 'check':
+            return self._check(self._config(request), self._arg(request, 'reset', bool, False))
+        if cmd == 'dump':
+            if 'file' not in request:
+                raise RuntimeError("dump needs a file")
+            file = self._arg(request, 'file', str)
+            try:
+                with open(file, "w") as wf:
+                    wf.write(self.wc.dump())
+            except OSError as e:
+                # not a device error, so don't let it reopen the controller
+                raise RuntimeError(f"Can't write {file}: {e.strerror}")
+            return {'file': file}
+        return super()._dispatch(cmd, request)
+
+    def run(self, input, output):
+        """Carry out each command read from input, writing one JSON result per line to output"""
+        for line in input:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line in ('quit', 'exit'):
+                break
+
+            start = time.perf_counter()
+            request = {}
+            try:
+                request = parseCommand(line)
+                reply = self.dispatch(request)
+                reply['ok'] = True
+            except Exception as e:
+                reply = {'ok': False, 'error': str(e)}
+                self.failed += 1
+            reply['cmd'] = request.get('cmd')
+            if 'id' in request:
+                reply['id'] = request['id']
+            reply['elapsed'] = time.perf_counter() - start
+            self.commands += 1
+            output.write(json.dumps(reply) + "\n")
+            output.flush()
+        return self.pending() or []
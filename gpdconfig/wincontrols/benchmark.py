@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import ctypes
+import timeit
+import argparse
+import platform
+import subprocess
+import statistics
+import tempfile
+import tracemalloc
+
+from . import WinControls, defaults
+from .simulator import Simulator
+from . import hidraw
+from .library import ProfileStore
+from .config import KeyCodes
+from .metrics import Metrics
+
+__all__ = ['TimedDevice', 'summarise', 'benchProtocol', 'benchVerify', 'benchCtypes', 'benchPython', 'benchBuffers', 'benchLibrary', 'benchStartup', 'main']
+
+class TimedDevice:
+    """Wraps a device and records the latency of every HID transaction by opcode."""
+
+    def __init__(self, device):
+        self.device = device
+        self.samples = {}
+        self._op = None
+        self._elapsed = 0
+
+    def _record(self, op, elapsed):
+        self.samples.setdefault(f"0x{op:02x}", []).append(elapsed)
+
+    def send_feature_report(self, data):
+        start = time.perf_counter()
+        result = self.device.send_feature_report(data)
+        elapsed = time.perf_counter() - start
+
+        op = data[2]
+        if op in (0x21, 0x23): # writes don't have replies
+            self._record(op, elapsed)
+        else:
+            self._op, self._elapsed = op, elapsed
+        return result
+
+    def get_input_report(self, report_id, size):
+        start = time.perf_counter()
+        result = self.device.get_input_report(report_id, size)
+        self._record(self._op, self._elapsed + time.perf_counter() - start)
+        return result
+
+    def get_input_report_into(self, report_id, buffer):
+        start = time.perf_counter()
+        result = self.device.get_input_report_into(report_id, buffer)
+        self._record(self._op, self._elapsed + time.perf_counter() - start)
+        return result
+
+    def close(self):
+        self.device.close()
+
+def summarise(samples):
+    """Return a latency distribution in microseconds for a list of durations in seconds"""
+    us = sorted(s * 1e6 for s in samples)
+    return {
+        'count': len(us),
+        'min': us[0],
+        'mean': statistics.fmean(us),
+        'median': statistics.median(us),
+        'p95': us[min(len(us) - 1, int(len(us) * 0.95))],
+        'max': us[-1],
+        'total': sum(us),
+    }
+
+def benchProtocol(backend, iterations, write=False, disableFwCheck=False):
+    """Time full read (and optionally write) cycles against a device"""
+    wc = WinControls(read=False, disableFwCheck=disableFwCheck, backend=backend)
+    wc.device = timed = TimedDevice(wc.device)
+
+    cycles = {'read': [], 'write': [], 'roundtrip': []}
+    waits = {}
+    for _ in range(iterations):
+        start = time.perf_counter()
+        wc.readConfig()
+        middle = time.perf_counter()
+        cycles['read'].append(middle - start)
+        if write:
+            wc.writeConfig(force=True)
+            end = time.perf_counter()
+            cycles['write'].append(end - middle)
+            cycles['roundtrip'].append(end - start)
+        for id, polls, elapsed, ready in wc.waitStats:
+            waits.setdefault(f"0x{id:02x}", []).append(polls)
+        wc.waitStats.clear()
+    wc.device.close()
+
+    return {
+        'cycles': {name: summarise(s) for name, s in cycles.items() if s},
+        'opcodes': {op: summarise(s) for op, s in sorted(timed.samples.items())},
+        'readyPolls': {op: {'mean': statistics.fmean(p), 'max': max(p)} for op, p in sorted(waits.items())},
+    }
+
+def benchVerify(backend, iterations, disableFwCheck=False):
+    """Time writes at each verification level"""
+    wc = WinControls(disableFwCheck=disableFwCheck, backend=backend)
+    results = {}
+    for level in WinControls.verifyLevels:
+        samples = []
+        for _ in range(iterations):
+            wc.writeConfig(force=True, verify=level)
+            samples.append(wc.writeTimes['total'])
+        results[level] = summarise(samples)
+    wc.close()
+    return results
+
+def _timePerCall(stmt, number):
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e6
+
+def benchCtypes(number):
+    """Time the ctypes buffer handling done by hid.Device for each 65 byte report"""
+    def report():
+        data = ctypes.create_string_buffer(65)
+        data[0] = bytearray((1,))
+        return data.raw[:65]
+
+    return {
+        'create_string_buffer': _timePerCall(lambda: ctypes.create_string_buffer(65), number),
+        'get_input_report_buffers': _timePerCall(report, number),
+    }
+
+def _allocated(function):
+    """Peak bytes allocated by one call of function"""
+    function()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        function()
+        return tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+def benchBuffers(number):
+    """Compare allocating and copying report buffers per request with reusing preallocated ones"""
+    reply = bytearray(65)
+    view = (ctypes.c_char * 65).from_buffer(reply)
+    request = bytearray([0x01, 0xa5, 0, 0x5a, 0, 0]) + bytearray(27)
+    padding = bytes(26)
+    data = [2]
+
+    def copyReport():
+        buf = ctypes.create_string_buffer(65)
+        buf[0] = bytearray((1,))
+        return buf.raw[:65]
+
+    def reuseReport():
+        reply[0] = 1
+        return view
+
+    def buildRequest():
+        result = bytearray([0x01, 0xa5, 0x11, 0x5a, 0x11^0xFF, 00])
+        result.extend(data)
+        result.extend(bytearray(33-len(result)))
+        return bytes(result)
+
+    def fillRequest():
+        request[2] = 0x11
+        request[4] = 0x11^0xFF
+        request[6:7] = data
+        request[7:] = padding
+        return request
+
+    wc = WinControls(read=False, backend=Simulator())
+    wc._waitReady(0x10)
+    measured = WinControls(read=False, backend=Simulator(), metrics=Metrics())
+    measured._waitReady(0x10)
+
+    results = {}
+    for name, function in (('input_report_copy', copyReport), ('input_report_reuse', reuseReport),
+                           ('request_build', buildRequest), ('request_fill', fillRequest),
+                           ('_sendReq_0x11', lambda: wc._sendReq(0x11, data)),
+                           ('_sendReq_0x11_metrics', lambda: measured._sendReq(0x11, data))):
+        results[name] = {'us': _timePerCall(function, number), 'bytes': _allocated(function)}
+    return results
+
+def benchPython(number):
+    """Time the pure python config encoding and decoding"""
+    wc = WinControls(backend=Simulator())
+    wc.setConfig(defaults)
+    raw = wc._generateConfig()
+    other = wc.config.update([('a', 'Z')])
+
+    values = [field.unpack(raw) for field in WinControls._fields]
+
+    def decodePerField():
+        return [field.unpack(raw) for field in WinControls._fields]
+
+    def encodePerField():
+        config = bytearray(256)
+        for field, value in zip(WinControls._fields, values):
+            field.pack(config, value)
+        return config
+
+    return {
+        '_parseConfig': _timePerCall(lambda: wc._parseConfig(raw), number),
+        '_generateConfig': _timePerCall(wc._generateConfig, number),
+        'decode_per_setting': _timePerCall(decodePerField, number),
+        'encode_per_setting': _timePerCall(encodePerField, number),
+        'setConfig': _timePerCall(lambda: wc.setConfig(defaults), number),
+        'dump': _timePerCall(wc.dump, number),
+        'snapshot': _timePerCall(wc.snapshot, number),
+        'equality': _timePerCall(lambda: wc.snapshot() == other, number),
+        'diff_changed': _timePerCall(lambda: wc.config.diff(other), number),
+    }
+
+# directory containing the gpdconfig package, for running it in a fresh interpreter
+_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _runPython(args, runs):
+    """Return the fastest wall clock time in ms for running python with args, or None if it fails"""
+    env = dict(os.environ, PYTHONPATH=_root)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, *args], env=env, capture_output=True)
+        times.append((time.perf_counter() - start) * 1000)
+        if result.returncode:
+            return None
+    return min(times)
+
+def benchLibrary(size, number):
+    """Time building, refreshing and applying profiles from a library of size profiles"""
+    keys = [k for k in KeyCodes.code if KeyCodes.code[k] <= 0xe7]
+    base = "".join(line + "\n" for line in defaults.split("\n") if line)
+    with tempfile.TemporaryDirectory() as root:
+        profiles = os.path.join(root, 'profiles')
+        os.mkdir(profiles)
+        for i in range(size):
+            with open(os.path.join(profiles, f"profile{i:05d}.txt"), "w") as wf:
+                wf.write(base + f"a={keys[i % len(keys)]}\nb={keys[(i // len(keys)) % len(keys)]}\n")
+
+        start = time.perf_counter()
+        store = ProfileStore(profiles, os.path.join(root, 'cache'))
+        cold = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store.refresh()
+        warm = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ProfileStore(profiles, os.path.join(root, 'cache'))
+        reopen = time.perf_counter() - start
+
+        names = store.names()
+        with open(os.path.join(profiles, names[0] + ".txt")) as rf:
+            text = rf.readlines()
+        wc = WinControls(offline=True)
+        wc.loadImage(bytes(256))
+
+        def applyText():
+            wc.setConfig(text)
+            wc._generateConfig()
+
+        def applyImage():
+            wc.loadImage(store.image(names[len(names) // 2]))
+            wc._generateConfig()
+
+        return {
+            'profiles': size,
+            'images': len({store.hash(name) for name in names}),
+            'compile_all_ms': cold * 1000,
+            'refresh_ms': warm * 1000,
+            'reopen_ms': reopen * 1000,
+            'lookup_us': _timePerCall(lambda: store.image(names[len(names) // 2]), number),
+            'apply_text_us': _timePerCall(applyText, number),
+            'apply_image_us': _timePerCall(applyImage, number),
+        }
+
+def benchStartup(runs):
+    """Time CLI startup for metadata-only commands against importing and initialising hidapi"""
+    probe = "import sys, gpdconfig.app; print(int('ctypes' in sys.modules))"
+    loaded = subprocess.run([sys.executable, "-c", probe], env=dict(os.environ, PYTHONPATH=_root),
+                            capture_output=True, text=True).stdout.strip()
+
+    return {
+        'interpreter_ms': _runPython(["-c", "pass"], runs),
+        'keys_ms': _runPython(["-m", "gpdconfig", "--keys"], runs),
+        'field_help_ms': _runPython(["-m", "gpdconfig", "--field-help", "a"], runs),
+        'hidapi_load_ms': _runPython(["-c", "import gpdconfig.wincontrols.hidapi"], runs),
+        'ctypes_imported_by_cli': loaded == "1",
+    }
+
+def _printTable(title, rows):
+    print(f"\n{title}")
+    for name, stats in rows.items():
+        if isinstance(stats, dict):
+            print(f"  {name:<26} n={stats['count']:<5} min={stats['min']:9.1f} median={stats['median']:9.1f} p95={stats['p95']:9.1f} max={stats['max']:9.1f} us")
+        else:
+            print(f"  {name:<26} {stats:9.2f} us/call")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the GPD Win controller protocol and config handling.")
+    parser.add_argument("-b","--backend", choices=["hidapi","hidraw","simulator"], default="simulator", help="Device backend to benchmark (default: simulator)")
+    parser.add_argument("-n","--iterations", type=int, default=20, help="Number of protocol cycles to run")
+    parser.add_argument("-w","--write", action="store_true", help="Also benchmark writing the config back (always on for the simulator)")
+    parser.add_argument("-x","--disable-version-check", dest="fwcheck", action="store_true", help="Disable FW version check")
+    parser.add_argument("--sim-latency", dest="simlatency", metavar="MS", type=float, default=0, help="Simulated latency per HID report in milliseconds")
+    parser.add_argument("--sim-not-ready", dest="simnotready", metavar="N", type=int, default=0, help="Number of not-ready replies before the simulated controller is ready")
+    parser.add_argument("--library-size", dest="librarysize", metavar="N", type=int, default=500, help="Number of profiles in the library benchmark (default: 500)")
+    parser.add_argument("-j","--json", metavar="FILE", help="Write results as JSON to FILE ('-' for stdout)")
+    options = parser.parse_args()
+
+    backend = None
+    if options.backend == "simulator":
+        backend = Simulator(latency=options.simlatency/1000, notReady=options.simnotready)
+    elif options.backend == "hidraw":
+        backend = hidraw
+
+    results = {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'backend': options.backend,
+        'iterations': options.iterations,
+        'protocol': benchProtocol(backend, options.iterations, options.write or options.backend == "simulator", options.fwcheck),
+        'verify': benchVerify(backend, options.iterations, options.fwcheck) if options.write or options.backend == "simulator" else None,
+        'ctypes': benchCtypes(10000),
+        'python_us': benchPython(1000),
+        'buffers': benchBuffers(10000),
+        'library': benchLibrary(options.librarysize, 1000),
+        'startup': benchStartup(5),
+    }
+
+    if options.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+
+    if options.json:
+        with open(options.json, "w") as wf:
+            json.dump(results, wf, indent=2)
+
+    _printTable("Protocol cycles", results['protocol']['cycles'])
+    _printTable("Per-opcode transactions", results['protocol']['opcodes'])
+    print("\nReadiness polls")
+    for op, polls in results['protocol']['readyPolls'].items():
+        print(f"  {op:<26} mean={polls['mean']:.1f} max={polls['max']}")
+    if results['verify']:
+        _printTable("Write verification levels", results['verify'])
+    _printTable("ctypes buffer overhead", results['ctypes'])
+    _printTable("Config encoding", results['python_us'])
+
+    print("\nReport buffers")
+    for name, result in results['buffers'].items():
+        print(f"  {name:<26} {result['us']:9.2f} us/call {result['bytes']:6} bytes allocated")
+
+    print("\nProfile library")
+    for name, value in results['library'].items():
+        print(f"  {name:<26} {value:9.2f}" if isinstance(value, float) else f"  {name:<26} {value}")
+
+    print("\nStartup")
+    for name, value in results['startup'].items():
+        if value is None:
+            value = "unavailable"
+        elif isinstance(value, float):
+            value = f"{value:.1f}"
+        print(f"  {name:<26} {value}")
+
+if __name__ == "__main__":
+    main()
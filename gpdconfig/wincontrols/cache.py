@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+
+__all__ = ['ConfigCache', 'defaultCacheDir']
+
+def defaultCacheDir():
+    """Return the default directory for gpdconfig's cache files"""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'gpdconfig')
+
+class ConfigCache:
+    """On-disk copy of the last known config image and firmware info of each controller, keyed by device identity.
+
+    WinControls only trusts an entry when the controller's 0x12 checksum and firmware
+    version match it. The checksum is a plain byte sum, so a change that keeps the
+    sum the same (e.g. swapping two keys) would go unnoticed; only enable the cache
+    where that is acceptable.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or defaultCacheDir()
+
+    def _file(self, identity):
+        name = hashlib.sha1(identity.encode()).hexdigest()
+        return os.path.join(self.directory, f"{name}.json")
+
+    def load(self, identity):
+        """Return (image, info) for a device, or None if it isn't cached"""
+        try:
+            with open(self._file(identity)) as rf:
+                entry = json.load(rf)
+            image = bytes.fromhex(entry['image'])
+        except (OSError, ValueError, KeyError):
+            return None
+        if entry.get('identity') != identity or len(image) != 256:
+            return None
+        return image, entry['info']
+
+    def store(self, identity, image, info):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._file(identity)
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "w") as wf:
+            json.dump({'identity': identity, 'info': info, 'image': bytes(image).hex()}, wf)
+        os.replace(temp, path)
+
+    def discard(self, identity):
+        try:
+            os.unlink(self._file(identity))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import os
+import concurrent.futures
+
+from . import defaults
+from .hardware import WinControls
+
+__all__ = ['compileProfile', 'decompileImage', 'compileFile', 'decompileFile', 'convertTree']
+
+def compileProfile(profile, base=defaults):
+    """Compile a profile (text or list of key=value lines) into a raw 256 byte config image, starting from base"""
+    wc = WinControls(offline=True)
+    wc.loadImage(bytes(256))
+    if base:
+        wc.setConfig(base)
+    wc.setConfig(profile)
+    return wc._generateConfig()
+
+def decompileImage(configRaw):
+    """Convert a raw 256 byte config image back into profile text"""
+    wc = WinControls(offline=True)
+    wc.loadImage(configRaw)
+    try:
+        return wc.dump()
+    except KeyError as e:
+        raise RuntimeError(f"Invalid keycode {e} in config image")
+
+def compileFile(src, dst):
+    with open(src, 'r') as rf:
+        configRaw = compileProfile(rf.readlines())
+    with open(dst, 'wb') as wf:
+        wf.write(configRaw)
+
+def decompileFile(src, dst):
+    with open(src, 'rb') as rf:
+        profile = decompileImage(rf.read())
+    with open(dst, 'w') as wf:
+        wf.write(profile)
+
+def _convert(function, src, dst):
+    try:
+        function(src, dst)
+        return src, dst, None
+    except Exception as e:
+        return src, dst, str(e)
+
+def _jobs(src, dst, decompile):
+    """Yield (src, dst) pairs for every file to convert"""
+    if not os.path.isdir(src):
+        yield src, dst
+        return
+
+    os.makedirs(dst, exist_ok=True)
+    suffix = '.txt' if decompile else '.bin'
+    with os.scandir(src) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name.startswith('.'):
+                continue
+            name, ext = os.path.splitext(entry.name)
+            if (ext == '.bin') != decompile:
+                continue
+            yield entry.path, os.path.join(dst, name + suffix)
+
+def convertTree(src, dst, decompile=False, jobs=None):
+    """Compile a file or directory of profiles into raw images (or decompile images back into profiles).
+
+    Files are converted by a pool of worker processes, streaming over the directory so only a
+    bounded number are queued at once. Yields (src, dst, error) for each file, where error is
+    None on success, so one bad profile doesn't abort the batch.
+    """
+    function = decompileFile if decompile else compileFile
+    work = _jobs(src, dst, decompile)
+
+    if jobs == 1:
+        for s, d in work:
+            yield _convert(function, s, d)
+        return
+
+    workers = jobs or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        limit = workers * 4
+        pending = set()
+        for s, d in work:
+            pending.add(pool.submit(_convert, function, s, d))
+            if len(pending) >= limit:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
@@ -1,4 +1,5 @@
 import struct
+import collections.abc
 
 class KeyCodes:
     """Keycode mapping for the GPD Win controls. This is the same as the standard usb hid keycodes, up to RIGHTMETA/0xe7. After that are custom codes for the mouse buttons and wheel."""
@@ -211,30 +212,30 @@ class KeyCodes:
     key = {v:k for k,v in code.items()}
 
 class Setting:
-    """Base class for configuration settings."""
+    """Base class for configuration settings. Holds no value; see Config and BoundSetting."""
     def __init__(self, offset, name, description):
         self.offset = offset
         self.name = name
         self.description = description
-        self._values = 0,
 
-    # Single value getter and setter
-    def set(self, value):
+    # Conversion between a setting's value and its raw values in the config image
+    def parse(self, value):
         if type(value) == str:
             value = int(value)
-        self._values = value,
+        return value,
 
-    def get(self):
-        return self._values[0]
+    def format(self, values):
+        return values[0]
 
-    def apply(self, config: bytearray):
-        struct.pack_into(self._format, config, self.offset, *self._values)
+    # Raw values of the setting in a config image
+    def unpack(self, config: bytearray):
+        return struct.unpack_from(self._format, config, self.offset)
 
-    def decode(self, config: bytearray):
-        self._values = struct.unpack_from(self._format, config, self.offset)
+    def pack(self, config: bytearray, values):
+        struct.pack_into(self._format, config, self.offset, *values)
 
     def __repr__(self):
-        return f"{self.name}={self.get()}"
+        return f"{type(self).__name__}({self.offset}, '{self.name}')"
 
     def help(self):
         return f"{self.description} : {self.__doc__}"
@@ -244,14 +245,14 @@ class Key(Setting):
     _format = '<H'
     kc = KeyCodes()
 
-    def set(self, key: str):
+    def parse(self, key: str):
         key = key.upper()
         if key not in Key.kc.code:
             raise RuntimeError(f"Invalid key '{key}'. Must be one of {list(Key.kc.code.keys())}")
-        super().set(Key.kc.code[key])
+        return Key.kc.code[key],
 
-    def get(self):
-        return Key.kc.key[super().get()]
+    def format(self, values):
+        return Key.kc.key[values[0]]
 
 class Signed(Setting):
     """Signed offset for the deadzone and centering settings. Keep to the range -10 to 10."""
@@ -265,10 +266,10 @@ class Rumble(Setting):
     """The rumble mode. 0=off, 1=low, 2=high."""
     _format = '<B'
 
-    def set(self, value):
+    def parse(self, value):
         if value not in ('0','1','2'):
             raise RuntimeError("Rumble must be 0,1 or 2.")
-        super().set(value)
+        return super().parse(value)
 
 class LedMode(Setting):
     """(Win4 only) The LED mode. One of off, solid, breathe or rotate."""
@@ -277,24 +278,155 @@ class LedMode(Setting):
     code = {'off':0, 'solid':0x01, 'breathe':0x11, 'rotate':0x21}
     mode = {v:k for k,v in code.items()}
 
-    def set(self, mode):
+    def parse(self, mode):
         mode = mode.lower()
         if mode not in self.code:
             raise RuntimeError(f"Invalid mode '{mode}'. Must be 'off', 'solid', 'breathe' or 'rotate'.")
-        self._values = (self.code[mode], )
+        return self.code[mode],
 
-    def get(self):
-        code = self._values[0]
-        return self.mode.get(code, 'off')
+    def format(self, values):
+        return self.mode.get(values[0], 'off')
 
 class Colour(Setting):
     """(Win4 only) The LED colour. Given as a hex string in the format RRGGBB."""
     _format = "<BBB"
 
-    def set(self, value):
+    def parse(self, value):
         if type(value) == str:
             value = int(value, 16)
-        self._values = (value & 0xff, (value >> 8) & 0xff, (value >> 16) & 0xff)
+        return (value & 0xff, (value >> 8) & 0xff, (value >> 16) & 0xff)
+
+    def format(self, values):
+        return f"{values[2]:02x}{values[1]:02x}{values[0]:02x}"
+
+class Layout:
+    """Where each setting lives in the config image, compiled into one struct so Config can read all of them in a single call.
+
+    Settings are written one at a time with Setting.pack(), leaving the rest of the image as it was.
+    """
+
+    def __init__(self, fields, size=256):
+        self.size = size
+        # in their original order, for listing
+        self.fields = list(fields)
+        self.field = {f.name: f for f in self.fields}
+        self._layout = []
+        layout = "<"
+        offset = 0
+        count = 0
+        for field in sorted(fields, key=lambda f: f.offset):
+            if field.offset < offset:
+                raise RuntimeError(f"Setting '{field.name}' overlaps the previous setting")
+            if field.offset > offset:
+                layout += f"{field.offset - offset}x"
+            format = field._format.lstrip("<")
+            values = len(struct.unpack("<" + format, bytes(struct.calcsize("<" + format))))
+            self._layout.append((field, count, count + values))
+            layout += format
+            offset = field.offset + struct.calcsize("<" + format)
+            count += values
+        if offset > size:
+            raise RuntimeError("Settings do not fit in the config image")
+        layout += f"{size - offset}x"
+        self.struct = struct.Struct(layout)
+
+    def values(self, config: bytearray):
+        """Yield each setting with its raw values in config"""
+        values = self.struct.unpack_from(config)
+        for field, start, end in self._layout:
+            yield field, values[start:end]
+
+class Config:
+    """Immutable config state backed by a 256 byte image.
+
+    Changes return a new Config, so a snapshot is just a reference and is never affected
+    by later changes. Configs are equal when their images are.
+    """
+    __slots__ = ('image', 'layout')
+
+    def __init__(self, image, layout):
+        self.image = bytes(image)
+        self.layout = layout
+
+    def __eq__(self, other):
+        return isinstance(other, Config) and self.image == other.image
+
+    def __hash__(self):
+        return hash(self.image)
+
+    def __getitem__(self, name):
+        field = self.layout.field[name]
+        return field.format(field.unpack(self.image))
+
+    def update(self, settings):
+        """Return a copy with the given (name, value) settings changed"""
+        image = bytearray(self.image)
+        for name, value in settings:
+            field = self.layout.field[name]
+            field.pack(image, field.parse(value))
+        return Config(image, self.layout)
+
+    def diff(self, base):
+        """Return a list of (name, old, new) tuples for settings that differ from base"""
+        if self.image == base.image:
+            return []
+        return [(field.name, field.format(old), field.format(new))
+                for (field, new), (_, old) in zip(self.layout.values(self.image), self.layout.values(base.image))
+                if new != old]
+
+    def dump(self):
+        values = dict(self.layout.values(self.image))
+        return "\n".join(f"{field.name}={field.format(values[field])}" for field in self.layout.fields)
+
+    def __repr__(self):
+        return f"Config({self.image.hex()})"
+
+class BoundSetting:
+    """A Setting whose get() and set() act on the config of one WinControls instance"""
+    __slots__ = ('setting', 'owner')
+
+    def __init__(self, setting, owner):
+        self.setting = setting
+        self.owner = owner
+
+    def __getattr__(self, name):
+        return getattr(self.setting, name)
 
     def get(self):
-        return f"{self._values[2]:02x}{self._values[1]:02x}{self._values[0]:02x}"
+        return self.owner.config[self.setting.name]
+
+    def set(self, value):
+        self.owner._update([(self.setting.name, value)])
+
+    def __repr__(self):
+        return f"{self.setting.name}={self.get()}"
+
+class Fields:
+    """Descriptor giving the Settings by name on the class, and BoundSettings on an instance"""
+
+    def __init__(self, fields):
+        self.settings = {f.name: f for f in fields}
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self.settings
+        return _FieldView(self.settings, instance)
+
+class _FieldView(collections.abc.Mapping):
+    __slots__ = ('settings', 'owner')
+
+    def __init__(self, settings, owner):
+        self.settings = settings
+        self.owner = owner
+
+    def __getitem__(self, name):
+        return BoundSetting(self.settings[name], self.owner)
+
+    def __contains__(self, name):
+        return name in self.settings
+
+    def __iter__(self):
+        return iter(self.settings)
+
+    def __len__(self):
+        return len(self.settings)
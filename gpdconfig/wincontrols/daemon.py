@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import socket
+import socketserver
+
+from . import defaults
+from .hardware import deviceErrors
+
+__all__ = ['defaultSocket', 'Dispatcher', 'Server', 'Client', 'connect']
+
+def defaultSocket():
+    """Return the default path of the daemon's unix socket"""
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return os.path.join(runtime, 'gpdconfig.sock')
+    return f"/tmp/gpdconfig-{os.getuid()}.sock"
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                reply = self.server.dispatch(json.loads(line))
+                reply['ok'] = True
+            except Exception as e:
+                reply = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+            if self.server.metricsFile:
+                self.server.wc.metrics.writeTextfile(self.server.metricsFile)
+
+class Dispatcher:
+    """Carries out JSON requests against one WinControls instance, for the daemon and batch mode.
+
+    Requests are dicts with a "cmd" key:
+        {"cmd": "get", "refresh": false}      cached config and firmware info
+        {"cmd": "raw"}                        cached raw config image as hex
+        {"cmd": "set", "config": [...], "reset": false, "force": false, "verify": "checksum"}
+        {"cmd": "apply", "profile": "..."}    defaults plus the given profile
+        {"cmd": "apply", "name": "...", "config": [...]}   a profile from the library, by name, plus config lines
+        {"cmd": "profiles"}                   names of the profiles in the library
+        {"cmd": "metrics"}                    the WinControls metrics as JSON
+        {"cmd": "history"}                    the controller's entries in the WinControls journal
+        {"cmd": "rollback", "ref": ...}       an image from the journal, by sequence number, -N or time
+    """
+
+    def __init__(self, wc, wait=0, library=None):
+        self.wc = wc
+        # optional ProfileStore for applying profiles by name
+        self.library = library
+        self.stale = False
+        # how long to wait for the controller to come back when reopening it
+        self.wait = wait
+
+    def _state(self):
+        return {'config': self.wc.dump(), 'info': self.wc.info}
+
+    def _refresh(self):
+        if self.stale:
+            self.wc.close()
+            if self.wait and hasattr(self.wc.backend, 'wait'):
+                self.wc.backend.wait(serial=self.wc.serial or None, timeout=self.wait)
+            self.wc._openHid()
+            self.stale = False
+        self.wc.readConfig()
+
+    def _current(self):
+        """Re-read the config if another process changed the controller since it was last read or written"""
+        if not self.wc.unchanged():
+            self._refresh()
+
+    def _stage(self, config, reset=False, image=None):
+        if image is not None:
+            self.wc.loadImage(image)
+        elif reset:
+            self.wc.setConfig(defaults)
+        if config:
+            self.wc.setConfig(config)
+
+    def _set(self, config, reset=False, force=False, verify='checksum', image=None):
+        wc = self.wc
+        # hold the lock so the diff and skip check are against what the controller holds
+        with wc.transaction():
+            self._current()
+            before = wc.snapshot()
+            try:
+                self._stage(config, reset, image)
+                changes = wc.diff()
+                written = wc.writeConfig(force=force, verify=verify)
+            except Exception:
+                # drop the settings that weren't written
+                wc.restore(before)
+                raise
+        reply = self._state()
+        reply['written'] = written
+        reply['changes'] = changes
+        return reply
+
+    def _library(self):
+        if not self.library:
+            raise RuntimeError("No profile library configured")
+        return self.library
+
+    def _journal(self):
+        if not self.wc.journal:
+            raise RuntimeError("No config journal configured")
+        return self.wc.journal
+
+    def _history(self):
+        self._current()
+        current = bytes(self.wc._configRaw or b'')
+        return [{'seq': entry['seq'], 'time': entry['time'], 'firmware': entry['firmware'], 'current': entry['image'] == current}
+                for entry in self._journal().entries(self.wc.identity)]
+
+    def _rollback(self, ref, force=False, verify='checksum'):
+        with self.wc.transaction():
+            self._current()
+            info = self.wc.info
+            entry = self._journal().select(ref, self.wc.identity, info and info['Xfirmware'] + info['Kfirmware'])
+            reply = self._set(None, force=force, verify=verify, image=entry['image'])
+        reply['seq'] = entry['seq']
+        return reply
+
+    @staticmethod
+    def _arg(request, key, kind, default=None):
+        """Return a request argument, checking it has the expected type"""
+        value = request.get(key, default)
+        if not isinstance(value, kind):
+            raise RuntimeError(f"Invalid '{key}' argument: {value!r}")
+        return value
+
+    def _config(self, request):
+        config = self._arg(request, 'config', (list, str), [])
+        if isinstance(config, list) and not all(isinstance(line, str) for line in config):
+            raise RuntimeError("Invalid 'config' argument: must be field=value strings")
+        return config
+
+    def dispatch(self, request):
+        if not isinstance(request, dict):
+            raise RuntimeError("Request must be a JSON object")
+        cmd = request.get('cmd')
+        try:
+            if self.stale or (cmd == 'get' and self._arg(request, 'refresh', bool, False)):
+                self._refresh()
+            reply = self._dispatch(cmd, request)
+        except RuntimeError:
+            raise
+        except deviceErrors() as e:
+            # the device backend failed, so reopen it on the next request
+            self.stale = True
+            raise RuntimeError(f"Device error: {e}")
+        if reply is None:
+            raise RuntimeError(f"Unknown command '{cmd}'")
+        return reply
+
+    def _dispatch(self, cmd, request):
+        """Carry out one request, returning None for an unknown command"""
+        if cmd == 'get':
+            return self._state()
+        if cmd == 'raw':
+            return {'raw': bytes(self.wc._configRaw).hex()}
+        force = self._arg(request, 'force', bool, False)
+        verify = self._arg(request, 'verify', str, 'checksum')
+        if cmd == 'set':
+            return self._set(self._config(request), self._arg(request, 'reset', bool, False), force, verify)
+        if cmd == 'metrics':
+            if not self.wc.metrics:
+                raise RuntimeError("Metrics are not enabled")
+            return {'metrics': self.wc.metrics.snapshot()}
+        if cmd == 'history':
+            return {'history': self._history()}
+        if cmd == 'rollback':
+            if 'ref' not in request:
+                raise RuntimeError("rollback needs a journal reference")
+            return self._rollback(self._arg(request, 'ref', (str, int)), force, verify)
+        if cmd == 'profiles':
+            return {'profiles': self._library().names()}
+        if cmd == 'apply' and 'name' in request:
+            return self._set(self._config(request), force=force, verify=verify,
+                             image=self._library().image(self._arg(request, 'name', str)))
+        if cmd == 'apply':
+            return self._set(self._arg(request, 'profile', str, ''), reset=True, force=force, verify=verify)
+        return None
+
+class Server(Dispatcher, socketserver.UnixStreamServer):
+    """Serves config requests for one WinControls instance over a unix socket, keeping the device open between requests.
+
+    Each line received is one JSON request, as described for Dispatcher, answered with one JSON line.
+    """
+
+    def __init__(self, wc, path=None, wait=0, library=None, metricsFile=None):
+        Dispatcher.__init__(self, wc, wait, library)
+        # rewritten with the WinControls metrics after every request
+        self.metricsFile = metricsFile
+        self.path = path or defaultSocket()
+        if os.path.exists(self.path):
+            if connect(self.path):
+                raise RuntimeError(f"gpdconfig daemon already running on {self.path}")
+            os.unlink(self.path)
+        socketserver.UnixStreamServer.__init__(self, self.path, _Handler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class Client:
+    """Sends requests to a running gpdconfig daemon."""
+
+    def __init__(self, path=None):
+        self.path = path or defaultSocket()
+
+    def request(self, cmd, **args):
+        args['cmd'] = cmd
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.path)
+            sock.sendall(json.dumps(args).encode() + b"\n")
+            sock.shutdown(socket.SHUT_WR)
+            reply = json.loads(sock.makefile('rb').readline())
+        if not reply.pop('ok'):
+            raise RuntimeError(reply['error'])
+        return reply
+
+def connect(path=None):
+    """Return a Client if a daemon is listening on path, otherwise None"""
+    client = Client(path)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(client.path)
+    except OSError:
+        return None
+    return client
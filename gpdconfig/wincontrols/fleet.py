@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import time
+import concurrent.futures
+
+from .hardware import WinControls
+
+__all__ = ['runFleet']
+
+def _run(operation, config, image, path, force, verify, options):
+    result = {'path': path, 'serial': None, 'ok': False, 'error': None, 'changes': [], 'written': False}
+    start = time.perf_counter()
+    wc = None
+    try:
+        wc = WinControls(path=path, **options)
+        result['serial'] = wc.serial
+        result['firmware'] = wc.info and wc.info['Xfirmware'] + wc.info['Kfirmware']
+        if image is not None:
+            wc.loadImage(image)
+        if config:
+            wc.setConfig(config)
+        if image is not None or config:
+            result['changes'] = wc.diff()
+        if operation == 'write':
+            result['written'] = wc.writeConfig(force=force, verify=verify)
+            result['writeTimes'] = wc.writeTimes
+            result['ok'] = True
+        elif operation == 'verify':
+            result['ok'] = not result['changes']
+        else:
+            result['config'] = wc.dump()
+            result['snapshot'] = wc.snapshot()
+            result['ok'] = True
+    except Exception as e:
+        result['error'] = str(e)
+    finally:
+        if wc:
+            result['retries'] = dict(wc.retries)
+            wc.close()
+    result['elapsed'] = time.perf_counter() - start
+    return result
+
+def runFleet(operation, config=None, image=None, backend=None, paths=None, serials=None, workers=None, force=False, verify='checksum', **options):
+    """Read, verify or write config on every attached controller concurrently.
+
+    operation is 'read', 'verify' (check each controller already matches config) or
+    'write' (apply config and write it). config is a list of config lines, applied on
+    top of the raw 256 byte image if one is given, e.g. a compiled library profile.
+    Controllers can be limited to the given HID paths or serial numbers, and verify
+    selects how writes are checked (see WinControls.writeConfig). Other keyword
+    arguments are passed to WinControls.
+    Returns a list of per-controller result dicts and the total wall clock time; reads
+    include each controller's config as text and as a Config snapshot.
+    """
+    if operation not in ('read', 'verify', 'write'):
+        raise RuntimeError(f"Unknown fleet operation '{operation}'")
+    if operation != 'read' and not config and image is None:
+        raise RuntimeError(f"No config given to {operation}")
+
+    start = time.perf_counter()
+    devices = WinControls.devices(backend)
+    if paths:
+        paths = [p.encode() if isinstance(p, str) else p for p in paths]
+        devices = [dev for dev in devices if dev['path'] in paths]
+    if serials:
+        devices = [dev for dev in devices if dev['serial_number'] in serials]
+    if not devices:
+        raise RuntimeError("No matching GPD controller devices")
+
+    options['backend'] = backend
+    with concurrent.futures.ThreadPoolExecutor(workers or len(devices)) as pool:
+        results = list(pool.map(lambda dev: _run(operation, config, image, dev['path'], force, verify, options), devices))
+
+    return results, time.perf_counter() - start
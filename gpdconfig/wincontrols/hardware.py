@@ -1,13 +1,49 @@
 #!/usr/bin/env python3
 
+import time
 import struct
+import functools
+import threading
+import contextlib
+import collections
 
 from .config import *
-
-try:
-    from . import hid
-except ImportError:
-    import hid
+from .polling import PollStrategy, RetryPolicy
+from .lock import DeviceLock
+
+hid = None
+
+def _loadHid():
+    """Import the hidapi backend on first device access, so metadata-only use never touches native code"""
+    global hid
+    if hid is None:
+        from . import hidapi as module
+        hid = module
+    return hid
+
+def deviceErrors():
+    """Return the exception types raised by device backends when the device itself fails"""
+    if hid is None:
+        return (OSError,)
+    return (OSError, hid.HIDException)
+
+_unlocked = contextlib.nullcontext()
+
+def _transaction(method):
+    """Run a method holding the device lock, and the thread lock in thread-safe mode"""
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._mutex or _unlocked, self.lock or _unlocked:
+            return method(self, *args, **kwargs)
+    return locked
+
+def _synchronized(method):
+    """Run a method holding the thread lock in thread-safe mode"""
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._mutex or _unlocked:
+            return method(self, *args, **kwargs)
+    return locked
 
 class WinControls():
     """Class for reading and writing configuration to the GPD Win controller hardware."""
@@ -80,25 +116,124 @@ class WinControls():
         Millis(94,'r4delay4','R4 macro delay 4'),
     ]
 
-    field = {f.name: f for f in _fields}
+    # the Settings by name; on an instance, views whose get() and set() use its config
+    field = Fields(_fields)
+
+    # whole-image layout of _fields, compiled once
+    _layout = Layout(_fields)
+
+    # post-write verification levels, cheapest first
+    verifyLevels = ('none', 'checksum', 'readback')
 
-    def __init__(self, read=True, disableFwCheck=False):
+    def __init__(self, read=True, disableFwCheck=False, backend=None, poll=None, offline=False, path=None, serial=None, tracer=None, cache=None,
+                 lockTimeout=None, threadSafe=False, metrics=None, retry=None, journal=None):
         self.disableFwCheck = disableFwCheck
-        self._openHid()
+        # which controller to open, None for the first one found
+        self._select = (path.encode() if isinstance(path, str) else path, serial)
+        # identity of the opened controller
+        self.path = None
+        self.serial = None
+        # this instance's settings; the Setting objects themselves hold no state
+        self.config = Config(bytes(256), self._layout)
+        # set from another thread to abandon a pending readiness wait
+        self.abort = threading.Event()
+        self.poll = poll or PollStrategy()
+        # (request id, polls, seconds, ready) for recent readiness waits
+        self.waitStats = collections.deque(maxlen=64)
+        self.retry = retry or RetryPolicy()
+        # retries made, by cause
+        self.retries = collections.Counter()
+        self._retried = 0
+        self._exhausted = False
         self.loaded = False
+        # raw config as last read from or committed to the device
+        self._configRaw = None
+        # firmware info from the last readiness reply
+        self.info = None
+        # optional Tracer recording every request and reply
+        self.tracer = tracer
+        # optional Metrics counting requests, waits, reads and writes
+        self.metrics = metrics
+        # durations of the stages of the last write
+        self.writeTimes = None
+        # optional ConfigCache, and whether the last read was served from it
+        self.cache = cache
+        self.cacheHit = False
+        # optional Journal recording every committed image
+        self.journal = journal
+        # seconds to wait for the inter-process DeviceLock, None to not lock
+        self.lockTimeout = lockTimeout
+        self.lock = None
+        # guards the instance when it is shared between threads
+        self._mutex = threading.RLock() if threadSafe else None
+        # preallocated report buffers reused by every request
+        self._request = bytearray([0x01, 0xa5, 0, 0x5a, 0, 0]) + bytearray(27)
+        self._padding = [bytes(27-n) for n in range(28)]
+        self._reply = bytearray(65)
+        self._replyView = memoryview(self._reply)
+
+        if offline:
+            # config handling only, for converting profiles without a device
+            self.backend = self.device = None
+            return
+
+        # any object providing hid-style enumerate() and Device(), e.g. a Simulator
+        self.backend = backend or _loadHid()
+        self._openHid()
         if read:
             self.readConfig()
 
+    @property
+    def identity(self):
+        """Stable name for the opened controller: its serial number, or HID path if it has none"""
+        if self.serial:
+            return self.serial
+        return self.path.decode(errors='replace') if self.path else None
+
+    @staticmethod
+    def devices(backend=None):
+        """List the configuration interfaces of all attached controllers"""
+        backend = backend or _loadHid()
+        return [dev for dev in backend.enumerate(vid=0x2f24) if dev['usage_page'] == 0xff00]
+
+    @staticmethod
+    def _lockKey(dev):
+        """Name the controller the same whichever backend found it, so hidapi and hidraw users share a lock"""
+        if dev['serial_number']:
+            return f"{dev['vendor_id']:04x}:{dev['product_id']:04x}:{dev['serial_number']}"
+        # nothing stable to go by, so fall back to the backend's path
+        return dev['path']
+
     def _openHid(self):
         self.device = None
-        for dev in hid.enumerate(vid=0x2f24):
-            if dev['usage_page'] == 0xff00:
-                #print(dev['path'])
-                self.device = hid.Device(path=dev['path'])
-                break
+        path, serial = self._select
+        for dev in self.devices(self.backend):
+            if path is not None and dev['path'] != path:
+                continue
+            if serial is not None and dev['serial_number'] != serial:
+                continue
+            #print(dev['path'])
+            self.device = self.backend.Device(path=dev['path'])
+            self.path = dev['path']
+            self.serial = dev['serial_number']
+            if self.lockTimeout is not None:
+                self.lock = DeviceLock(self._lockKey(dev), self.lockTimeout)
+            break
         if not self.device:
             raise RuntimeError("Unable to open GPD controller device")
 
+    @contextlib.contextmanager
+    def transaction(self):
+        """Hold the locks across several operations, e.g. setConfig() and writeConfig()"""
+        with self._mutex or _unlocked, self.lock or _unlocked:
+            yield self
+
+    def close(self):
+        """Close the device"""
+        if self.device:
+            self.device.close()
+            self.device = None
+
     def _cdata(self, configRaw: bytearray, index):
         return bytes(struct.pack("<H",index)) + configRaw[index<<4:(index+1)<<4]
 
@@ -106,18 +241,14 @@ class WinControls():
         return sum(configRaw)
 
     def _parseConfig(self, configRaw: bytearray):
-        for field in self._fields:
-            field.decode(configRaw)
+        self.config = Config(configRaw, self._layout)
         self.loaded = True
 
     def _generateConfig(self):
         if not self.loaded:
             raise RuntimeError("No config loaded")
 
-        configRaw = bytearray(256)
-        for field in self._fields:
-            field.apply(configRaw)
-        return configRaw
+        return bytearray(self.config.image)
 
     def _parseResponse(self, response):
         info = struct.unpack_from("<8xBBBBB11xII", response)
@@ -128,38 +259,99 @@ class WinControls():
             'checksum': info[5]
         }
 
+    def _checksumError(self, stage):
+        if self.metrics:
+            self.metrics.count('checksum_errors_total', stage=stage)
+
     def _checkDevice(self):
         if self.disableFwCheck:
             return
         supported = ['K504', 'K407', 'K406']
         info = self._parseResponse(self._response)
         if info['Kfirmware'] not in supported:
+            if self.metrics:
+                self.metrics.count('firmware_check_failures_total')
             raise RuntimeError(f"Unsupported firmware version: {info['Xfirmware']}{info['Kfirmware']}")
 
     def _waitReady(self, id):
+        start = time.monotonic()
+        deadline = start + self.poll.timeout if self.poll.timeout else None
+        polls = 0
+        ready = False
+
         self._response = None
-        while self._response is None or self._response[8] != 0xaa:
+        for delay in self.poll.delays():
+            if delay:
+                if deadline:
+                    delay = min(delay, deadline - time.monotonic())
+                if delay > 0:
+                    self.abort.wait(delay)
+            self._checkAbort("waiting for controller")
             self._response = self._sendReq(id)
+            polls += 1
+            if self._response[8] == 0xaa:
+                ready = True
+                break
+            if deadline and time.monotonic() >= deadline:
+                break
+
+        elapsed = time.monotonic() - start
+        self.waitStats.append((id, polls, elapsed, ready))
+        metrics = self.metrics
+        if metrics:
+            op = f"0x{id:02x}"
+            metrics.count('ready_polls_total', polls, op=op)
+            metrics.observe('ready_wait_seconds', elapsed, op=op)
+            if not ready:
+                metrics.count('ready_timeouts_total', op=op)
+        if not ready:
+            raise RuntimeError(f"Controller not ready after {polls} polls")
+        self.info = self._parseResponse(self._response)
         self._checkDevice()
 
     def _sendReq(self,id,data=None):
-        result = bytearray([0x01, 0xa5, id, 0x5a, id^0xFF, 00])
-
-        if (data):
-            result.extend(data)
-        result.extend(bytearray(33-len(result)))
-
-        self.device.send_feature_report(bytes(result))
-
-        #print("Sent: %s" % result.hex())
+        tracer = self.tracer
+        metrics = self.metrics
+        if tracer or metrics:
+            start = time.perf_counter()
+
+        # build the request in place in the reusable report buffer
+        request = self._request
+        request[2] = id
+        request[4] = id^0xFF
+
+        length = len(data) if data else 0
+        if length > 27:
+            raise RuntimeError("Request data too long")
+        if length:
+            request[6:6+length] = data
+        request[6+length:] = self._padding[length]
+
+        self.device.send_feature_report(request)
+
+        result = None
         if (id != 0x21 and id != 0x23): # writes don't have replies
-            result = self.device.get_input_report(1,65)
-            #print("Recv: %s" % result.hex())
-            return result
-
+            readInto = getattr(self.device, 'get_input_report_into', None)
+            if readInto is None:
+                result = self.device.get_input_report(1,65)
+            else:
+                # only valid until the next request
+                result = self._replyView[:readInto(1, self._reply)]
+
+        if tracer:
+            tracer.record(id, request, result, start)
+        if metrics:
+            op = f"0x{id:02x}"
+            metrics.count('transactions_total', op=op)
+            metrics.observe('transaction_seconds', time.perf_counter() - start, op=op)
+        return result
+
+    @_transaction
     def _readConfig(self):
         self._waitReady(0x10)
+        return self._readBlocks() or self._retryRead()
 
+    def _readBlocks(self):
         self._configRaw = bytearray()
         for addr in range(4):
             self._configRaw.extend(self._sendReq(0x11,[addr]))
@@ -167,37 +359,232 @@ class WinControls():
         self._response = self._sendReq(0x12)
         return self._parseResponse(self._response)['checksum'] == self._checksum(self._configRaw)
 
+    def _retries(self, cause):
+        """Yield before each retry allowed by the retry policy and its budget, after backing off"""
+        self._retried = 0
+        self._exhausted = False
+        for delay in self.retry.delays():
+            if not self.retry.spend():
+                self._exhausted = True
+                if self.metrics:
+                    self.metrics.count('retry_budget_exhausted_total', cause=cause)
+                return
+            self._retried += 1
+            self.retries[cause] += 1
+            if self.metrics:
+                self.metrics.count('retries_total', cause=cause)
+            if self.abort.wait(delay):
+                raise RuntimeError("Aborted retrying")
+            yield
+
+    def _retryRead(self):
+        """Read the blocks again after a checksum mismatch; the controller stays ready for reading"""
+        for _ in self._retries('read_checksum'):
+            if self._readBlocks():
+                return True
+        return False
+
+    def _attempts(self):
+        """Describe the retries made by the last failed operation, for its error message"""
+        if self._exhausted:
+            return f" after {self._retried + 1} attempts (retry budget exhausted)"
+        return f" after {self._retried + 1} attempts" if self._retried else ""
+
+    def _holds(self, configRaw, info):
+        """Return whether the device's checksum and firmware match configRaw, without reading it"""
+        self._response = self._sendReq(0x12)
+        reply = self._parseResponse(self._response)
+        return (reply['ready'] == 0xaa and reply['checksum'] == self._checksum(configRaw)
+                and reply['Xfirmware'] == info['Xfirmware'] and reply['Kfirmware'] == info['Kfirmware'])
+
+    @_transaction
+    def unchanged(self):
+        """Return whether the device still holds the config last read or written, e.g. not changed by another process"""
+        if self._configRaw is None or self.info is None:
+            return False
+        return self._holds(self._configRaw, self.info)
+
+    def _readCached(self):
+        """Use the cached config if the device's checksum and firmware still match it"""
+        cached = self.cache.load(self.identity)
+        if not cached:
+            return False
+        configRaw, info = cached
+        if not self._holds(configRaw, info):
+            return False
+
+        self._checkDevice()
+        self.info = info
+        self._configRaw = bytearray(configRaw)
+        return True
+
+    @_transaction
     def readConfig(self):
         """Read the current configuration from the device."""
-
+        if not self.metrics:
+            return self._read()
+
+        start = time.perf_counter()
+        try:
+            self._read()
+        except RuntimeError:
+            self.metrics.count('errors_total', operation='read')
+            raise
+        self.metrics.count('reads_total', source='cache' if self.cacheHit else 'device')
+        self.metrics.observe('read_seconds', time.perf_counter() - start)
+
+    def _read(self):
         self.loaded = False
 
-        if self._readConfig():
+        self.cacheHit = bool(self.cache) and self._readCached()
+        if self.cacheHit:
             self._parseConfig(self._configRaw)
+        elif self._readConfig():
+            self._parseConfig(self._configRaw)
+            self.retry.succeeded()
+            if self.cache:
+                self.cache.store(self.identity, self._configRaw, self.info)
         else:
-            raise RuntimeError("Checksum error reading config")
+            self._checksumError('read')
+            raise RuntimeError(f"Checksum error reading config{self._attempts()}")
+
+    @_synchronized
+    def diff(self):
+        """Return a list of (field, old, new) tuples for settings that differ from the config on the device"""
+        if self._configRaw is None:
+            raise RuntimeError("No config read from device")
+
+        return self.config.diff(Config(self._configRaw, self._layout))
+
+    @_synchronized
+    def snapshot(self):
+        """Return the current config; it is immutable, so later changes don't affect it"""
+        return self.config
+
+    @_synchronized
+    def restore(self, config):
+        """Go back to a config returned by snapshot()"""
+        self.config = config
+        self.loaded = True
 
-    def writeConfig(self):
-        """Write the current configuration to the device."""
+    def _readback(self, configRaw):
+        """Read the config back from the device and compare it byte-wise with configRaw"""
+        if not self._readConfig():
+            # what the device holds is unknown now
+            self._configRaw = None
+            self._checksumError('readback')
+            raise RuntimeError(f"Checksum error reading back config{self._attempts()}")
+        for offset, (written, read) in enumerate(zip(configRaw, self._configRaw)):
+            if written != read:
+                self._checksumError('readback')
+                raise RuntimeError(f"Readback mismatch at offset {offset}: wrote 0x{written:02x}, read 0x{read:02x}")
+
+    @_transaction
+    def writeConfig(self, force=False, verify='checksum'):
+        """Write the current configuration to the device. Returns False if it was skipped because nothing changed.
+
+        verify is one of verifyLevels: 'none' commits without checking the 0x22 checksum,
+        'checksum' only commits if it matches, and 'readback' also reads the committed
+        config back and compares every byte. Each stage's duration is kept in writeTimes.
+        """
+        if not self.metrics:
+            return self._write(force, verify)
+
+        start = time.perf_counter()
+        try:
+            written = self._write(force, verify)
+        except RuntimeError:
+            self.metrics.count('errors_total', operation='write')
+            raise
+        self.metrics.count('writes_total', result='written' if written else 'skipped')
+        if written:
+            self.metrics.observe('write_seconds', time.perf_counter() - start, verify=verify)
+        return written
+
+    def _write(self, force, verify):
+        if verify not in self.verifyLevels:
+            raise RuntimeError(f"Unknown verification level '{verify}'")
         configRaw = self._generateConfig()
 
+        if not force and self._configRaw is not None and self._configRaw == configRaw:
+            return False
+
+        times = self.writeTimes = {'verify': verify}
+        start = time.perf_counter()
         self._waitReady(0x20)
 
+        self._writeBlocks(configRaw)
+        mark = time.perf_counter()
+        times['transfer'] = mark - start
+
+        if verify != 'none':
+            if not self._writeChecked(configRaw) and not self._retryWrite(configRaw):
+                self._checksumError('write')
+                raise RuntimeError(f"Checksum error writing config{self._attempts()}")
+            times['checksum'] = time.perf_counter() - mark
+            mark = time.perf_counter()
+
+        # commit config, unless the caller gave up on this write meanwhile
+        self._checkAbort("before committing config")
+        self._sendReq(0x23)
+        self._configRaw = configRaw
+        times['commit'] = time.perf_counter() - mark
+        # journal what was committed even if the readback below fails, so history stays accurate
+        if self.journal:
+            self.journal.append(self.identity, configRaw, self.info)
+
+        if verify == 'readback':
+            mark = time.perf_counter()
+            try:
+                self._readback(configRaw)
+            except RuntimeError:
+                if self.cache:
+                    self.cache.discard(self.identity)
+                raise
+            times['readback'] = time.perf_counter() - mark
+
+        times['total'] = time.perf_counter() - start
+        self.retry.succeeded()
+        if self.cache:
+            self.cache.store(self.identity, configRaw, self.info)
+        return True
+
+    def _checkAbort(self, doing):
+        if self.abort.is_set():
+            raise RuntimeError(f"Aborted {doing}")
+
+    def _writeBlocks(self, configRaw):
         for block in range(8):
+            self._checkAbort("writing config")
             self._sendReq(0x21,self._cdata(configRaw, block))
 
+    def _writeChecked(self, configRaw):
+        """Return whether the controller's checksum of the blocks sent matches configRaw"""
         self._response = self._sendReq(0x22)
-        if self._parseResponse(self._response)['checksum'] == self._checksum(configRaw):
-            # valid checksum so commit config
-            self._sendReq(0x23)
-        else:
-            raise RuntimeError("Checksum error writing config")
-
+        return self._parseResponse(self._response)['checksum'] == self._checksum(configRaw)
+
+    def _retryWrite(self, configRaw):
+        """Send the blocks again after a checksum mismatch; nothing is committed until 0x23"""
+        for _ in self._retries('write_checksum'):
+            self._writeBlocks(configRaw)
+            if self._writeChecked(configRaw):
+                return True
+        return False
+
+    @_synchronized
+    def loadImage(self, configRaw: bytearray):
+        """Load the configuration from a raw 256 byte config image"""
+        if len(configRaw) != 256:
+            raise RuntimeError(f"Config image must be 256 bytes, not {len(configRaw)}")
+        self._parseConfig(configRaw)
+
+    @_synchronized
     def setConfig(self, config):
         """Update the configuration from a list or newline separated string of key=value pairs"""
         if type(config) == str:
             config = config.split("\n")
 
+        settings = []
         for line in config:
             if line == "" or line.startswith("#"):
                 continue
@@ -212,10 +599,17 @@ class WinControls():
             if not key in self.field:
                 raise RuntimeError("Invalid config key: %s" % key)
 
-            self.field[key].set(value)
+            settings.append((key, value))
 
+        # nothing changes unless every line is valid
+        self._update(settings)
         return True
 
+    @_synchronized
+    def _update(self, settings):
+        self.config = self.config.update(settings)
+
+    @_synchronized
     def dump(self):
         """Return the current configuration as a string"""
-        return "\n".join(map(str, self._fields))
+        return self.config.dump()
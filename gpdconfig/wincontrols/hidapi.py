@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import ctypes
+
+try:
+    from . import hid
+except ImportError:
+    import hid
+
+__all__ = ['Device', 'HIDException', 'enumerate']
+
+HIDException = hid.HIDException
+enumerate = hid.enumerate
+
+def _view(buffer):
+    """Return a ctypes view of a writable buffer, or a copy of a read-only one.
+
+    The view is made for a single call, so the caller's buffer is only exported
+    while hidapi uses it and can be resized afterwards.
+    """
+    if isinstance(buffer, bytes):
+        return buffer
+    try:
+        return (ctypes.c_char * len(buffer)).from_buffer(buffer)
+    except TypeError:
+        return bytes(buffer)
+
+class Device(hid.Device):
+    """hid.Device that also sends reports from, and reads them into, a caller's buffer without copying.
+
+    Buffers passed to the *_into methods keep a ctypes view while the device is open,
+    so reusing one costs no allocations, but it can't be resized until the device is
+    closed. Buffers sent with write() or send_feature_report() are only viewed per call.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._views = {}
+
+    def _call(self, function, buffer, *args):
+        return self._Device__hidcall(function, self._Device__dev, _view(buffer), len(buffer), *args)
+
+    def _into(self, function, buffer, *args):
+        cached = self._views.get(id(buffer))
+        if cached is None or cached[0] is not buffer:
+            if len(self._views) >= 8:
+                self._views.clear()
+            cached = self._views[id(buffer)] = (buffer, (ctypes.c_char * len(buffer)).from_buffer(buffer))
+        return self._Device__hidcall(function, self._Device__dev, cached[1], len(buffer), *args)
+
+    def write(self, data):
+        return self._call(hid.hidapi.hid_write, data)
+
+    def send_feature_report(self, data):
+        return self._call(hid.hidapi.hid_send_feature_report, data)
+
+    def read_into(self, buffer, timeout=None):
+        """Read a report into a writable buffer, returning the number of bytes read."""
+        if timeout is None:
+            return self._into(hid.hidapi.hid_read, buffer)
+        return self._into(hid.hidapi.hid_read_timeout, buffer, timeout)
+
+    def get_input_report_into(self, report_id, buffer):
+        """Read an input report into a writable buffer, returning its length."""
+        buffer[0] = report_id
+        return self._into(hid.hidapi.hid_get_input_report, buffer)
+
+    def get_feature_report_into(self, report_id, buffer):
+        """Read a feature report into a writable buffer, returning its length."""
+        buffer[0] = report_id
+        return self._into(hid.hidapi.hid_get_feature_report, buffer)
+
+    def close(self):
+        super().close()
+        self._views.clear()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import os
+import fcntl
+import select
+
+__all__ = ['Hidraw', 'Device', 'enumerate', 'describe', 'parseDescriptor']
+
+# ioctl request numbers from linux/hidraw.h
+def _IOC(dir, nr, size):
+    return (dir << 30) | (size << 16) | (ord('H') << 8) | nr
+
+_IOC_READWRITE = 3
+
+def HIDIOCSFEATURE(size):
+    return _IOC(_IOC_READWRITE, 0x06, size)
+
+def HIDIOCGFEATURE(size):
+    return _IOC(_IOC_READWRITE, 0x07, size)
+
+def HIDIOCGINPUT(size):
+    return _IOC(_IOC_READWRITE, 0x0A, size)
+
+def parseDescriptor(descriptor):
+    """Return the (usage page, usage) of each top level collection in a HID report descriptor"""
+    collections = []
+    page = usage = 0
+    depth = 0
+    i = 0
+    while i < len(descriptor):
+        prefix = descriptor[i]
+        if prefix == 0xfe:
+            # long item, skip it
+            i += 3 + descriptor[i+1] if i + 1 < len(descriptor) else 1
+            continue
+
+        size = (0, 1, 2, 4)[prefix & 3]
+        value = int.from_bytes(descriptor[i+1:i+1+size], 'little')
+        i += 1 + size
+
+        item = prefix & 0xfc
+        if item == 0x04:        # usage page
+            page = value
+        elif item == 0x08:      # usage
+            if size == 4:
+                page, usage = value >> 16, value & 0xffff
+            else:
+                usage = value
+        elif item == 0xa0:      # collection
+            if depth == 0:
+                collections.append((page, usage))
+            depth += 1
+        elif item == 0xc0:      # end collection
+            depth = max(depth - 1, 0)
+    return collections
+
+def _uevent(path):
+    info = {}
+    with open(path) as rf:
+        for line in rf:
+            key, _, value = line.rstrip("\n").partition("=")
+            info[key] = value
+    return info
+
+class Device:
+    """A /dev/hidraw device, with the same report methods as hid.Device."""
+
+    def __init__(self, vid=None, pid=None, serial=None, path=None, fd=None):
+        if fd is not None:
+            self.fd = fd
+        elif path:
+            self.fd = os.open(path, os.O_RDWR | os.O_CLOEXEC)
+        else:
+            raise ValueError('specify path or fd')
+        self._nonblocking = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def _ioctl(self, request, buffer):
+        if self.fd is None:
+            raise OSError('device closed')
+        return fcntl.ioctl(self.fd, request, buffer, True)
+
+    def _wait(self, timeout):
+        """Wait up to timeout ms (None for forever) for a report, returning False on timeout"""
+        if timeout is None and not self._nonblocking:
+            return True
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        return bool(poller.poll(0 if self._nonblocking else timeout))
+
+    def write(self, data):
+        return os.write(self.fd, data)
+
+    def read(self, size, timeout=None):
+        if not self._wait(timeout):
+            return b''
+        return os.read(self.fd, size)
+
+    def read_into(self, buffer, timeout=None):
+        if not self._wait(timeout):
+            return 0
+        return os.readv(self.fd, [buffer])
+
+    def get_input_report(self, report_id, size):
+        buffer = bytearray(size)
+        return bytes(buffer[:self.get_input_report_into(report_id, buffer)])
+
+    def get_input_report_into(self, report_id, buffer):
+        buffer[0] = report_id
+        return self._ioctl(HIDIOCGINPUT(len(buffer)), buffer)
+
+    def send_feature_report(self, data):
+        if not isinstance(data, bytearray):
+            data = bytearray(data)
+        return self._ioctl(HIDIOCSFEATURE(len(data)), data)
+
+    def get_feature_report(self, report_id, size):
+        buffer = bytearray(size)
+        return bytes(buffer[:self.get_feature_report_into(report_id, buffer)])
+
+    def get_feature_report_into(self, report_id, buffer):
+        buffer[0] = report_id
+        return self._ioctl(HIDIOCGFEATURE(len(buffer)), buffer)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    @property
+    def nonblocking(self):
+        return self._nonblocking
+
+    @nonblocking.setter
+    def nonblocking(self, value):
+        self._nonblocking = value
+
+class Hidraw:
+    """Backend talking to /dev/hidraw devices directly, discovered through sysfs.
+
+    The sysfs and dev directories can be pointed elsewhere, e.g. at a fake tree.
+    """
+
+    def __init__(self, sysfs='/sys/class/hidraw', dev='/dev'):
+        self.sysfs = sysfs
+        self.dev = dev
+
+    def describe(self, name, vid=0, pid=0):
+        """Return the enumerate() entries for one hidraw node, e.g. 'hidraw3'"""
+        device = os.path.join(self.sysfs, name, 'device')
+        try:
+            info = _uevent(os.path.join(device, 'uevent'))
+            bus, vendor, product = (int(v, 16) for v in info['HID_ID'].split(':'))
+        except (OSError, KeyError, ValueError):
+            return []
+        if (vid and vendor != vid) or (pid and product != pid):
+            return []
+
+        try:
+            with open(os.path.join(device, 'report_descriptor'), 'rb') as rf:
+                collections = parseDescriptor(rf.read())
+        except OSError:
+            collections = []
+
+        phys = info.get('HID_PHYS', '').rpartition('input')[2]
+        interface = int(phys) if phys.isdigit() else -1
+        return [{
+            'path': os.path.join(self.dev, name).encode(),
+            'vendor_id': vendor,
+            'product_id': product,
+            'serial_number': info.get('HID_UNIQ', ''),
+            'release_number': 0,
+            'manufacturer_string': '',
+            'product_string': info.get('HID_NAME', ''),
+            'usage_page': page,
+            'usage': usage,
+            'interface_number': interface,
+        } for page, usage in collections or [(0, 0)]]
+
+    def enumerate(self, vid=0, pid=0):
+        try:
+            names = sorted(os.listdir(self.sysfs))
+        except FileNotFoundError:
+            return []
+
+        devices = []
+        for name in names:
+            devices.extend(self.describe(name, vid, pid))
+        return devices
+
+    def Device(self, vid=None, pid=None, serial=None, path=None):
+        if path is None:
+            for dev in self.enumerate(vid or 0, pid or 0):
+                if serial is None or dev['serial_number'] == serial:
+                    path = dev['path']
+                    break
+            else:
+                raise OSError('unable to open device')
+        return Device(path=path)
+
+# the module itself can be used as a backend
+_default = Hidraw()
+enumerate = _default.enumerate
+describe = _default.describe
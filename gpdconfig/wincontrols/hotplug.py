@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import socket
+import struct
+import threading
+
+from . import hardware
+
+__all__ = ['DeviceIndex', 'UeventSource', 'parseUevent']
+
+NETLINK_KOBJECT_UEVENT = 15
+
+# multicast groups: raw kernel events, and events re-sent by udev once its rules have run
+KERNEL_GROUP = 1
+UDEV_GROUP = 2
+
+_UDEV_MAGIC = 0xfeedcafe
+
+def parseUevent(data):
+    """Return the properties of a kernel or udev netlink uevent message as a dict, or None if it isn't one"""
+    if data.startswith(b'libudev\0'):
+        if len(data) < 24 or struct.unpack_from("!I", data, 8)[0] != _UDEV_MAGIC:
+            return None
+        offset, length = struct.unpack_from("=II", data, 16)
+        properties = data[offset:offset+length]
+    elif b'@' in data.split(b'\0', 1)[0]:
+        # kernel message: "action@devpath\0KEY=VALUE\0..."
+        properties = data.split(b'\0', 1)[1] if b'\0' in data else b''
+    else:
+        return None
+
+    event = {}
+    for item in properties.split(b'\0'):
+        key, sep, value = item.partition(b'=')
+        if sep:
+            event[key.decode(errors='replace')] = value.decode(errors='replace')
+    return event
+
+class UeventSource:
+    """Iterable of device events received over a NETLINK_KOBJECT_UEVENT socket.
+
+    By default events come from udev, after its rules (e.g. 99-kb-hid.rules) have
+    been applied, so the device node is usable once its event arrives. Use
+    KERNEL_GROUP where no udev daemon is running.
+    """
+
+    def __init__(self, group=UDEV_GROUP):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.bind((0, group))
+        # closing doesn't interrupt a blocked recv, so wake up now and then to notice it
+        self.sock.settimeout(0.5)
+        self.closed = False
+
+    def __iter__(self):
+        while not self.closed:
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            event = parseUevent(data)
+            if event:
+                yield event
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+
+class DeviceIndex:
+    """Backend wrapper keeping a list of attached GPD controller interfaces up to date from hotplug events.
+
+    enumerate() answers from the index instead of rescanning the bus, and wait() blocks
+    until a matching controller is attached. On an add event only the new hidraw node
+    is looked up if the backend supports describe(); otherwise it is enumerated again.
+    Without an event source (e.g. not on Linux) wait() falls back to re-enumerating
+    every rescan seconds. Devices are opened through the wrapped backend.
+    """
+
+    vid = 0x2f24
+    pid = 0x0135
+
+    def __init__(self, backend=None, source=None, rescan=0.5):
+        self.backend = backend or hardware._loadHid()
+        self.rescan = rescan
+        self.events = 0
+        self._cond = threading.Condition()
+
+        if source is None:
+            try:
+                source = UeventSource()
+            except (OSError, AttributeError):
+                source = None
+        self.source = source
+
+        # subscribe before the initial scan so nothing attached in between is missed
+        self.devices = self._scan()
+        if source:
+            threading.Thread(target=self._listen, daemon=True).start()
+
+    def _scan(self):
+        return list(self.backend.enumerate(vid=self.vid))
+
+    def _listen(self):
+        for event in self.source:
+            self._handle(event)
+
+    def _handle(self, event):
+        if event.get('SUBSYSTEM') != 'hidraw' or f":{self.vid:04X}:{self.pid:04X}." not in event.get('DEVPATH', '').upper():
+            return
+
+        name = event.get('DEVNAME') or os.path.basename(event.get('DEVPATH', ''))
+        node = (name if name.startswith('/') else os.path.join('/dev', name)).encode()
+        action = event.get('ACTION')
+
+        with self._cond:
+            self.events += 1
+            remaining = [dev for dev in self.devices if dev['path'] != node]
+            if action == 'remove' and len(remaining) < len(self.devices):
+                self.devices = remaining
+            elif action == 'add' and hasattr(self.backend, 'describe'):
+                self.devices = remaining + self.backend.describe(os.path.basename(node.decode()), vid=self.vid)
+            elif action in ('add', 'remove', 'change'):
+                # backend paths aren't device nodes, so rescan
+                self.devices = self._scan()
+            self._cond.notify_all()
+
+    def _find(self, path=None, serial=None):
+        if isinstance(path, str):
+            path = path.encode()
+        for dev in self.devices:
+            if dev['usage_page'] != 0xff00:
+                continue
+            if (path is None or dev['path'] == path) and (serial is None or dev['serial_number'] == serial):
+                return dev
+        return None
+
+    def wait(self, path=None, serial=None, timeout=None):
+        """Wait up to timeout seconds (None for forever) for a matching controller, returning its enumerate() entry"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                dev = self._find(path, serial)
+                if dev:
+                    return dev
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise RuntimeError("Timed out waiting for GPD controller")
+                if self.source:
+                    self._cond.wait(remaining)
+                else:
+                    self._cond.wait(self.rescan if remaining is None else min(remaining, self.rescan))
+                    self.devices = self._scan()
+
+    def enumerate(self, vid=0, pid=0):
+        with self._cond:
+            return [dict(dev) for dev in self.devices
+                    if vid in (0, dev['vendor_id']) and pid in (0, dev['product_id'])]
+
+    def Device(self, vid=None, pid=None, serial=None, path=None):
+        return self.backend.Device(vid=vid, pid=pid, serial=serial, path=path)
+
+    def close(self):
+        if self.source:
+            self.source.close()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import zlib
+import fcntl
+import struct
+import datetime
+import threading
+
+__all__ = ['Journal', 'defaultJournalFile']
+
+def defaultJournalFile():
+    """Return the default path of the config history journal"""
+    base = os.environ.get('XDG_STATE_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'state')
+    return os.path.join(base, 'gpdconfig', 'journal')
+
+# magic, version, record size, capacity, next sequence number
+_header = struct.Struct("<4sHHIQ")
+# sequence number, unix time, device identity, firmware, config image, crc32 of the rest
+_record = struct.Struct("<Qd64s8s256sI")
+_magic = b"GPDJ"
+_version = 1
+_headerSize = 32
+
+def _name(identity):
+    """Return a device identity as stored in a record, truncated to fit"""
+    return identity.encode()[:64].decode(errors='ignore')
+
+class Journal:
+    """Append-only history of the config images committed to each controller.
+
+    Records have a fixed size and are stored in a ring of `capacity` slots after a
+    small header, so the file never grows past capacity records and a sequence number
+    maps straight to its slot. Sequence numbers and times only increase, so lookups by
+    time are a binary search. Appends from several processes are serialised with flock.
+    The file is only created by the first append.
+    """
+
+    def __init__(self, path=None, capacity=1024):
+        self.path = path or defaultJournalFile()
+        self.capacity = capacity
+        self._fd = None
+        self._lock = threading.Lock()
+
+    def _open(self, create=False):
+        if self._fd is not None:
+            return True
+        if not create and not os.path.exists(self.path):
+            return False
+        if create:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        return True
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _readHeader(self):
+        """Return (capacity, next sequence number), adopting the capacity of an existing file"""
+        data = os.pread(self._fd, _header.size, 0)
+        if len(data) < _header.size:
+            return self.capacity, 0
+        magic, version, size, capacity, next = _header.unpack(data)
+        if magic != _magic or version != _version or size != _record.size:
+            raise RuntimeError(f"{self.path} is not a gpdconfig journal")
+        self.capacity = capacity
+        return capacity, next
+
+    def _offset(self, seq):
+        return _headerSize + (seq % self.capacity) * _record.size
+
+    def append(self, identity, image, info, stamp=None):
+        """Record an image committed to a controller, returning its sequence number"""
+        if len(image) != 256:
+            raise RuntimeError(f"Config image must be 256 bytes, not {len(image)}")
+        firmware = (info['Xfirmware'] + info['Kfirmware']) if info else ""
+        with self._lock:
+            self._open(create=True)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                capacity, seq = self._readHeader()
+                # keep times in order even if the clock steps back, so lookups by time still work
+                stamp = stamp or time.time()
+                last = self._unpack(os.pread(self._fd, _record.size, self._offset(seq - 1))) if seq else None
+                if last:
+                    stamp = max(stamp, last['time'])
+                fields = (seq, stamp, _name(identity).encode(), firmware.encode()[:8], bytes(image))
+                record = _record.pack(*fields, zlib.crc32(_record.pack(*fields, 0)[:-4]))
+                os.pwrite(self._fd, record, self._offset(seq))
+                os.pwrite(self._fd, _header.pack(_magic, _version, _record.size, capacity, seq + 1), 0)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return seq
+
+    @staticmethod
+    def _unpack(data):
+        if len(data) < _record.size:
+            return None
+        seq, stamp, identity, firmware, image, crc = _record.unpack(data)
+        if zlib.crc32(data[:-4]) != crc:
+            return None
+        return {'seq': seq, 'time': stamp, 'identity': identity.rstrip(b'\0').decode(errors='replace'),
+                'firmware': firmware.rstrip(b'\0').decode(errors='replace'), 'image': image}
+
+    def span(self):
+        """Return the (first, next) sequence numbers of the records still held"""
+        with self._lock:
+            if not self._open():
+                return 0, 0
+            capacity, next = self._readHeader()
+        return max(0, next - capacity), next
+
+    def get(self, seq):
+        """Return the record with this sequence number, or None if it is unknown or overwritten"""
+        first, next = self.span()
+        if not first <= seq < next:
+            return None
+        with self._lock:
+            record = self._unpack(os.pread(self._fd, _record.size, self._offset(seq)))
+        # a slot may be overwritten by another process since span() was read
+        return record if record and record['seq'] == seq else None
+
+    def entries(self, identity=None, reverse=False):
+        """Yield the records held, oldest first, optionally only those of one controller"""
+        identity = identity and _name(identity)
+        first, next = self.span()
+        for seq in (range(next - 1, first - 1, -1) if reverse else range(first, next)):
+            record = self.get(seq)
+            if record and (identity is None or record['identity'] == identity):
+                yield record
+
+    def find(self, when, identity=None):
+        """Return the last record made at or before unix time when, or None"""
+        identity = identity and _name(identity)
+        first, next = self.span()
+        low, high = first, next
+        while low < high:
+            middle = (low + high) // 2
+            record = self.get(middle)
+            if record is not None and record['time'] > when:
+                high = middle
+            else:
+                low = middle + 1
+        for seq in range(low - 1, first - 1, -1):
+            record = self.get(seq)
+            if record and (identity is None or record['identity'] == identity):
+                return record
+        return None
+
+    def select(self, ref, identity, firmware=None):
+        """Return a controller's record given a sequence number, -N for N commits before its latest, or an ISO time.
+
+        Raises RuntimeError if there is no such record, it belongs to another controller,
+        or it was written under different firmware than `firmware`.
+        """
+        ref = str(ref).strip()
+        try:
+            number = int(ref)
+        except ValueError:
+            number = None
+
+        if number is None:
+            try:
+                when = datetime.datetime.fromisoformat(ref).timestamp()
+            except ValueError:
+                raise RuntimeError(f"Invalid journal reference '{ref}': expected a sequence number, -N or a time")
+            record = self.find(when, identity)
+            if record is None:
+                raise RuntimeError(f"No journal entry for this controller at or before {ref}")
+        elif number < 0:
+            record = next((r for i, r in enumerate(self.entries(identity, reverse=True)) if i == -number), None)
+            if record is None:
+                raise RuntimeError(f"Journal holds fewer than {-number + 1} entries for this controller")
+        else:
+            record = self.get(number)
+            if record is None:
+                raise RuntimeError(f"No journal entry {number}")
+            if record['identity'] != _name(identity):
+                raise RuntimeError(f"Journal entry {number} is for controller {record['identity']}, not {identity}")
+
+        if firmware and record['firmware'] and record['firmware'] != firmware:
+            raise RuntimeError(f"Journal entry {record['seq']} was written under firmware {record['firmware']}, not {firmware}")
+        return record
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+
+from .cache import defaultCacheDir
+from .compiler import compileProfile
+
+__all__ = ['ProfileStore', 'defaultLibraryDir']
+
+def defaultLibraryDir():
+    """Return the default profile library directory"""
+    base = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    return os.path.join(base, 'gpdconfig', 'profiles')
+
+class ProfileStore:
+    """A directory of profiles, each compiled once into its raw config image.
+
+    Profiles are the text files (compiled on top of the defaults) or raw .bin images
+    in a directory, named by their filename without the extension; a name shared by several
+    files is reported in errors rather than picking one. Compiled images are
+    stored under the cache directory by the sha256 of their content, with an index of
+    each profile's source mtime, size and image hash, so only profiles whose source
+    changed are compiled again, and identical profiles share one image.
+    """
+
+    def __init__(self, directory, cacheDir=None):
+        self.directory = os.path.abspath(directory)
+        self.cacheDir = cacheDir or os.path.join(defaultCacheDir(), 'profiles')
+        self.indexFile = os.path.join(self.cacheDir, f"index-{hashlib.sha1(self.directory.encode()).hexdigest()[:16]}.json")
+        # name -> {'file', 'mtime', 'size', 'hash'}
+        self.index = {}
+        # name -> compile error
+        self.errors = {}
+        self.compiled = 0
+        self._images = {}
+        try:
+            with open(self.indexFile) as rf:
+                self.index = json.load(rf)
+        except (OSError, ValueError):
+            pass
+        self.refresh()
+
+    def _imagePath(self, hash):
+        return os.path.join(self.cacheDir, 'images', f"{hash}.bin")
+
+    def _compile(self, name, file, stat):
+        path = os.path.join(self.directory, file)
+        try:
+            if file.endswith('.bin'):
+                with open(path, 'rb') as rf:
+                    image = rf.read()
+                if len(image) != 256:
+                    raise RuntimeError(f"Config image must be 256 bytes, not {len(image)}")
+            else:
+                with open(path, 'r') as rf:
+                    image = bytes(compileProfile(rf.readlines()))
+        except Exception as e:
+            self.errors[name] = str(e)
+            self.index.pop(name, None)
+            return
+
+        hash = hashlib.sha256(image).hexdigest()
+        imagePath = self._imagePath(hash)
+        if not os.path.exists(imagePath):
+            os.makedirs(os.path.dirname(imagePath), exist_ok=True)
+            temp = f"{imagePath}.{os.getpid()}.tmp"
+            with open(temp, 'wb') as wf:
+                wf.write(image)
+            os.replace(temp, imagePath)
+        self._images[hash] = image
+        self.errors.pop(name, None)
+        self.index[name] = {'file': file, 'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'hash': hash}
+        self.compiled += 1
+
+    def _current(self, entry, stat):
+        return entry is not None and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size
+
+    def _save(self):
+        os.makedirs(self.cacheDir, exist_ok=True)
+        temp = f"{self.indexFile}.{os.getpid()}.tmp"
+        with open(temp, 'w') as wf:
+            json.dump(self.index, wf)
+        os.replace(temp, self.indexFile)
+
+    def refresh(self):
+        """Compile any new or changed profiles and forget removed ones. Returns the number compiled."""
+        compiled = self.compiled
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    files.setdefault(os.path.splitext(entry.name)[0], []).append(entry)
+
+        seen = set()
+        for name, entries in files.items():
+            if len(entries) > 1:
+                self.errors[name] = f"several files are named '{name}': {', '.join(sorted(entry.name for entry in entries))}"
+                continue
+            entry = entries[0]
+            seen.add(name)
+            stat = entry.stat()
+            if not self._current(self.index.get(name), stat) or not os.path.exists(self._imagePath(self.index[name]['hash'])):
+                self._compile(name, entry.name, stat)
+
+        removed = set(self.index) - seen
+        for name in removed:
+            del self.index[name]
+        for name in set(self.errors) - set(files):
+            del self.errors[name]
+
+        if removed or self.compiled != compiled:
+            self._save()
+        return self.compiled - compiled
+
+    def names(self):
+        return sorted(self.index)
+
+    def hash(self, name):
+        """Return the content hash of a profile's compiled image"""
+        return self._entry(name)['hash']
+
+    def _entry(self, name):
+        if name not in self.index:
+            # perhaps added since the last refresh
+            self.refresh()
+        entry = self.index.get(name)
+        if entry is not None:
+            # recompile if the source changed since it was indexed
+            try:
+                stat = os.stat(os.path.join(self.directory, entry['file']))
+            except FileNotFoundError:
+                del self.index[name]
+                self._save()
+                entry = None
+            else:
+                if not self._current(entry, stat):
+                    self._compile(name, entry['file'], stat)
+                    self._save()
+                    entry = self.index.get(name)
+
+        if entry is None:
+            if name in self.errors:
+                raise RuntimeError(f"Profile '{name}' can't be used: {self.errors[name]}")
+            raise RuntimeError(f"Unknown profile '{name}'")
+        return entry
+
+    def image(self, name):
+        """Return the compiled 256 byte config image of a profile"""
+        return self.imageByHash(self._entry(name)['hash'])
+
+    def imageByHash(self, hash):
+        image = self._images.get(hash)
+        if image is None:
+            try:
+                with open(self._imagePath(hash), 'rb') as rf:
+                    image = rf.read()
+            except FileNotFoundError:
+                raise RuntimeError(f"No compiled image {hash}")
+            self._images[hash] = image
+        return image
+
+    def find(self, hash):
+        """Return the names of the profiles compiling to the image with this hash"""
+        return sorted(name for name, entry in self.index.items() if entry['hash'] == hash)
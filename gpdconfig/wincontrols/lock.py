@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import stat
+import fcntl
+import hashlib
+import threading
+
+__all__ = ['DeviceLock', 'defaultLockDir']
+
+def defaultLockDir():
+    """Return a directory shared by all users for lock files"""
+    if os.access('/run/lock', os.W_OK):
+        return '/run/lock'
+    # only needed here, and importing it at startup is slow
+    import tempfile
+    return tempfile.gettempdir()
+
+class DeviceLock:
+    """Advisory lock (flock) serialising transactions on one controller across processes and threads.
+
+    The lock file lives in a directory shared by all users, so e.g. a login script and
+    the user's own session exclude each other, and holds the pid of the current holder.
+    The lock is reentrant within a thread. acquire() gives up with a RuntimeError after
+    timeout seconds (None to wait forever).
+    """
+
+    def __init__(self, key, timeout=10.0, directory=None):
+        if isinstance(key, bytes):
+            key = key.decode(errors='replace')
+        self.key = key
+        self.timeout = timeout
+        self.file = os.path.join(directory or defaultLockDir(), f"gpdconfig-{hashlib.sha1(key.encode()).hexdigest()[:16]}.lock")
+        self.acquisitions = 0
+        # acquisitions that had to wait for another holder
+        self.contended = 0
+        self.waitTotal = 0.0
+        self.waitMax = 0.0
+        # pid seen holding the lock the last time we had to wait for it
+        self.lastHolder = None
+        self._fd = None
+        self._owner = None
+        self._depth = 0
+
+    def _open(self):
+        # the name is predictable and the directory world-writable, so never follow a planted symlink
+        flags = os.O_RDWR | os.O_NOFOLLOW | os.O_CLOEXEC
+        while True:
+            try:
+                fd = os.open(self.file, flags | os.O_CREAT | os.O_EXCL, 0o666)
+            except FileExistsError:
+                try:
+                    fd = os.open(self.file, flags)
+                except FileNotFoundError:
+                    # removed in between, so try creating it again
+                    continue
+                except OSError as e:
+                    raise RuntimeError(f"Refusing to use lock file {self.file}: {e.strerror}")
+                break
+            try:
+                # let other users take the lock too, whatever our umask
+                os.fchmod(fd, 0o666)
+            except OSError:
+                pass
+            break
+
+        info = os.fstat(fd)
+        if not stat.S_ISREG(info.st_mode) or info.st_nlink != 1:
+            os.close(fd)
+            raise RuntimeError(f"Refusing to use lock file {self.file}: not a plain file")
+        return fd
+
+    def holder(self):
+        """Return the pid recorded by the current or last holder, if any"""
+        try:
+            fd = os.open(self.file, os.O_RDONLY | os.O_NOFOLLOW | os.O_CLOEXEC)
+            try:
+                return int(os.read(fd, 32).strip() or 0) or None
+            finally:
+                os.close(fd)
+        except (OSError, ValueError):
+            return None
+
+    def acquire(self):
+        me = threading.get_ident()
+        if self._owner == me:
+            self._depth += 1
+            return
+
+        fd = self._open()
+        start = time.monotonic()
+        delay = 0.001
+        waited = None
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    pass
+                if waited is None:
+                    self.lastHolder = self.holder()
+                waited = time.monotonic() - start
+                if self.timeout is not None and waited >= self.timeout:
+                    raise RuntimeError(f"Controller is busy: locked by pid {self.holder() or 'unknown'} for over {self.timeout}s")
+                time.sleep(delay if self.timeout is None else min(delay, self.timeout - waited))
+                delay = min(delay * 2, 0.05)
+        except BaseException:
+            os.close(fd)
+            raise
+
+        if waited is not None:
+            self.contended += 1
+        waited = time.monotonic() - start
+        self.acquisitions += 1
+        self.waitTotal += waited
+        self.waitMax = max(self.waitMax, waited)
+
+        # overwrite the previous holder's pid in place; the file may belong to another user
+        os.pwrite(fd, f"{os.getpid():<10}\n".encode(), 0)
+        self._fd = fd
+        self._owner = me
+        self._depth = 1
+
+    def release(self):
+        if self._owner != threading.get_ident():
+            raise RuntimeError("Device lock released by a thread not holding it")
+        self._depth -= 1
+        if self._depth:
+            return
+        fd, self._fd, self._owner = self._fd, None, None
+        # closing drops the flock
+        os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.release()
+
+    def stats(self):
+        return {
+            'acquisitions': self.acquisitions,
+            'contended': self.contended,
+            'waitTotal': self.waitTotal,
+            'waitMax': self.waitMax,
+            'lastHolder': self.lastHolder,
+        }
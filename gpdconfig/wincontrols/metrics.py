@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import bisect
+import threading
+
+__all__ = ['Metrics', 'Histogram']
+
+# latency buckets in seconds, from a fast HID report to a slow readiness wait
+defaultBuckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class Histogram:
+    """Cumulative-style histogram with fixed upper bounds, as used by Prometheus"""
+
+    def __init__(self, buckets=defaultBuckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return (upper bound, count of observations <= it) pairs, ending with +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+class Metrics:
+    """Counters and latency histograms for WinControls operations.
+
+    Attach one to WinControls(metrics=...); instances may share one from several
+    threads. Without it, WinControls skips all instrumentation. Export with
+    prometheus() (text exposition format, e.g. for node_exporter's textfile
+    collector via writeTextfile()) or snapshot() for JSON.
+    """
+
+    # help text of each metric, by name without the prefix
+    help = {
+        'transactions_total': "HID requests sent, by opcode",
+        'transaction_seconds': "HID request and reply latency, by opcode",
+        'ready_polls_total': "Readiness polls sent, by opcode",
+        'ready_wait_seconds': "Time spent waiting for the controller to be ready, by opcode",
+        'ready_timeouts_total': "Readiness waits that gave up, by opcode",
+        'checksum_errors_total': "Checksum or readback mismatches that failed an operation, by stage",
+        'retries_total': "Reads and writes retried, by cause",
+        'retry_budget_exhausted_total': "Retries refused because the retry budget was used up, by cause",
+        'firmware_check_failures_total': "Controllers rejected by the firmware version check",
+        'reads_total': "Config reads, by source (device or cache)",
+        'read_seconds': "Config read duration",
+        'writes_total': "Config writes, by result (written or skipped)",
+        'write_seconds': "Config write duration, by verification level",
+        'errors_total': "Failed reads and writes, by operation",
+    }
+
+    def __init__(self, prefix='gpdconfig_', buckets=defaultBuckets):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def get(self, name, **labels):
+        """Return a counter's value"""
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        labels = list(labels) + list(extra)
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+    def prometheus(self):
+        """Return all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for kind, series in (('counter', self.counters), ('histogram', self.histograms)):
+                for name in sorted({name for name, _ in series}):
+                    full = self.prefix + name
+                    if name in self.help:
+                        lines.append(f"# HELP {full} {self.help[name]}")
+                    lines.append(f"# TYPE {full} {kind}")
+                    for (_, labels), value in sorted((k, v) for k, v in series.items() if k[0] == name):
+                        if kind == 'counter':
+                            lines.append(f"{full}{self._labels(labels)} {value}")
+                            continue
+                        for bound, total in value.cumulative():
+                            le = "+Inf" if bound == float('inf') else repr(bound)
+                            lines.append(f"{full}_bucket{self._labels(labels, [('le', le)])} {total}")
+                        lines.append(f"{full}_sum{self._labels(labels)} {value.sum!r}")
+                        lines.append(f"{full}_count{self._labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Return all metrics as a JSON-serialisable dict"""
+        def key(name, labels):
+            return self.prefix + name + self._labels(labels)
+
+        with self._lock:
+            return {
+                'counters': {key(*k): v for k, v in sorted(self.counters.items())},
+                'histograms': {key(*k): {
+                    'count': h.count,
+                    'sum': h.sum,
+                    'buckets': {("+Inf" if b == float('inf') else repr(b)): n for b, n in h.cumulative()},
+                } for k, h in sorted(self.histograms.items(), key=lambda item: item[0])},
+            }
+
+    def writeTextfile(self, path):
+        """Atomically write the metrics to path: JSON if it ends in .json, otherwise Prometheus text"""
+        data = json.dumps(self.snapshot(), indent=2) + "\n" if path.endswith('.json') else self.prometheus()
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "w") as wf:
+            wf.write(data)
+        os.replace(temp, path)
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import stat
+import socket
+import threading
+import collections
+
+from .config import KeyCodes
+from . import hardware
+
+__all__ = ['Monitor', 'RingBuffer', 'KeyboardDecoder', 'MouseDecoder', 'RawDecoder', 'Broadcaster', 'inputInterfaces']
+
+class RingBuffer:
+    """Fixed number of preallocated report slots, filled by one reader thread and drained by another.
+
+    Nothing is allocated per report. If the consumer falls a whole ring behind, new
+    reports are dropped and counted in overruns rather than stalling the reader.
+    """
+
+    def __init__(self, slots=4096, size=64):
+        self.slots = slots
+        self.size = size
+        self._data = bytearray(slots * size)
+        self._view = memoryview(self._data)
+        self._lengths = [0] * slots
+        self._times = [0.0] * slots
+        self.head = 0   # reports pushed
+        self.tail = 0   # reports drained
+        self.overruns = 0
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def push(self, report, length, stamp):
+        """Copy the first length bytes of a report into the next free slot; returns False if the ring is full"""
+        if self.head - self.tail >= self.slots:
+            self.overruns += 1
+            return False
+        length = min(length, self.size)
+        start = (self.head % self.slots) * self.size
+        self._view[start:start+length] = report[:length]
+        self._lengths[self.head % self.slots] = length
+        self._times[self.head % self.slots] = stamp
+        self.head += 1
+        return True
+
+    def drain(self, handler):
+        """Call handler(stamp, report) for every pending report, oldest first. The report view is only valid during the call."""
+        count = 0
+        while self.tail < self.head:
+            i = self.tail % self.slots
+            start = i * self.size
+            handler(self._times[i], self._view[start:start+self._lengths[i]])
+            self.tail += 1
+            count += 1
+        return count
+
+def _keyName(code):
+    return KeyCodes.key.get(code, f"0x{code:02x}")
+
+class KeyboardDecoder:
+    """Turns boot protocol keyboard reports into key press and release events"""
+
+    def __init__(self):
+        self.down = set()
+
+    def decode(self, report):
+        if len(report) == 9:
+            # leading report id
+            report = report[1:]
+        if len(report) < 8 or report[2] == 0x01:
+            # short report or rollover error
+            return []
+
+        down = {0xe0 + bit for bit in range(8) if report[0] & (1 << bit)}
+        down.update(code for code in report[2:8] if code > 0x03)
+
+        events = [{'type': 'key', 'key': _keyName(code), 'pressed': False} for code in sorted(self.down - down)]
+        events.extend({'type': 'key', 'key': _keyName(code), 'pressed': True} for code in sorted(down - self.down))
+        self.down = down
+        return events
+
+class MouseDecoder:
+    """Turns boot protocol mouse reports into button and axis events"""
+
+    buttons = ('MOUSE_LEFT', 'MOUSE_RIGHT', 'MOUSE_MIDDLE')
+
+    def __init__(self):
+        self.down = 0
+
+    def decode(self, report):
+        if len(report) < 3:
+            return []
+
+        events = []
+        changed = report[0] ^ self.down
+        for bit, name in enumerate(self.buttons):
+            if changed & (1 << bit):
+                events.append({'type': 'button', 'button': name, 'pressed': bool(report[0] & (1 << bit))})
+        self.down = report[0]
+
+        for axis, value in zip(('x', 'y', 'wheel'), report[1:4]):
+            if value:
+                events.append({'type': 'axis', 'axis': axis, 'value': value - 256 if value > 127 else value})
+        return events
+
+class RawDecoder:
+    """Passes reports from interfaces without a decoder through as hex"""
+
+    def decode(self, report):
+        return [{'type': 'report', 'data': bytes(report).hex()}]
+
+# decoder for each (usage page, usage)
+decoders = {
+    (0x01, 0x06): KeyboardDecoder,
+    (0x01, 0x02): MouseDecoder,
+}
+
+def inputInterfaces(backend=None, serial=None):
+    """List the input (non-configuration) interfaces of a controller, by default the first one found"""
+    backend = backend or hardware._loadHid()
+    devices = [dev for dev in backend.enumerate(vid=0x2f24) if dev['usage_page'] != 0xff00]
+    if serial is None and devices:
+        serial = devices[0]['serial_number']
+    return [dev for dev in devices if dev['serial_number'] == serial]
+
+class Broadcaster:
+    """Listens on a unix socket and copies everything written to it to every connected client.
+
+    Clients that can't keep up are disconnected rather than stalling the monitor.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            mode = os.lstat(path).st_mode
+        except FileNotFoundError:
+            pass
+        else:
+            # only replace a stale socket, never some other file given by mistake
+            if not stat.S_ISSOCK(mode):
+                raise RuntimeError(f"{path} exists and is not a socket")
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen()
+        self.clients = []
+        self._lock = threading.Lock()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            client.setblocking(False)
+            with self._lock:
+                self.clients.append(client)
+
+    def write(self, data):
+        data = data.encode()
+        with self._lock:
+            for client in list(self.clients):
+                try:
+                    client.sendall(data)
+                except OSError:
+                    self.clients.remove(client)
+                    client.close()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.sock.close()
+        with self._lock:
+            for client in self.clients:
+                client.close()
+            self.clients = []
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class Monitor:
+    """Streams decoded input events from a controller's input interfaces.
+
+    A reader thread per interface reads reports into its own RingBuffer, timestamping
+    each as it arrives, and run() decodes them and writes one JSON line per event to
+    every output:
+        {"t": 1.2345, "interface": 0, "type": "key", "key": "A", "pressed": true, "latency": 0.00004}
+    t is the time the report was read and latency how long it took to reach the outputs.
+    """
+
+    def __init__(self, interfaces, backend=None, outputs=None, slots=4096, timeout=50):
+        self.backend = backend or hardware._loadHid()
+        self.outputs = outputs if outputs is not None else [sys.stdout]
+        self.timeout = timeout
+        self.stop = threading.Event()
+        self.error = None
+        self.reports = 0
+        self.events = 0
+        # recent latencies, for stats()
+        self.latencies = collections.deque(maxlen=100000)
+        self._wake = threading.Event()
+        self._start = time.perf_counter()
+
+        self.readers = []
+        try:
+            for dev in interfaces:
+                decoder = decoders.get((dev['usage_page'], dev['usage']), RawDecoder)()
+                device = self.backend.Device(path=dev['path'])
+                self.readers.append((dev['interface_number'], device, RingBuffer(slots), decoder))
+        except Exception:
+            self.close()
+            raise
+        if not self.readers:
+            raise RuntimeError("No controller input interfaces found")
+
+    def _read(self, device, ring):
+        buffer = bytearray(ring.size)
+        while not self.stop.is_set():
+            try:
+                length = device.read_into(buffer, self.timeout)
+            except Exception as e:
+                self.error = e
+                self.stop.set()
+                self._wake.set()
+                return
+            if length > 0:
+                ring.push(buffer, length, time.perf_counter())
+                self._wake.set()
+
+    def _emit(self, interface, decoder):
+        def handler(stamp, report):
+            self.reports += 1
+            for event in decoder.decode(report):
+                now = time.perf_counter()
+                self.latencies.append(now - stamp)
+                line = json.dumps({'t': round(stamp - self._start, 6), 'interface': interface, **event,
+                                   'latency': round(now - stamp, 6)}) + "\n"
+                for output in self.outputs:
+                    output.write(line)
+                self.events += 1
+        return handler
+
+    def _drain(self, handlers):
+        for (_, _, ring, _), handler in zip(self.readers, handlers):
+            if ring.drain(handler):
+                for output in self.outputs:
+                    output.flush()
+
+    def run(self, duration=None):
+        """Stream events until stopped, or for duration seconds"""
+        threads = [threading.Thread(target=self._read, args=(device, ring), daemon=True) for _, device, ring, _ in self.readers]
+        handlers = [self._emit(interface, decoder) for interface, _, _, decoder in self.readers]
+        for thread in threads:
+            thread.start()
+
+        deadline = None if duration is None else time.perf_counter() + duration
+        try:
+            while not self.stop.is_set():
+                self._wake.wait(0.1)
+                self._wake.clear()
+                self._drain(handlers)
+                if deadline and time.perf_counter() >= deadline:
+                    break
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+            self._drain(handlers)
+            self.close()
+
+        if self.error:
+            raise RuntimeError(f"Error reading controller input: {self.error}")
+
+    def stats(self):
+        """Return report, event and overrun counts and event latency percentiles in microseconds"""
+        stats = {
+            'reports': self.reports,
+            'events': self.events,
+            'overruns': sum(ring.overruns for _, _, ring, _ in self.readers),
+            'elapsed': time.perf_counter() - self._start,
+        }
+        if self.latencies:
+            us = sorted(l * 1e6 for l in self.latencies)
+            for name, fraction in (('p50', 0.5), ('p99', 0.99), ('max', 1)):
+                stats[name] = us[min(len(us) - 1, int(len(us) * fraction))]
+        return stats
+
+    def close(self):
+        for _, device, _, _ in self.readers:
+            device.close()
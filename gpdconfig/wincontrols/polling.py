@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import random
+import threading
+
+__all__ = ['PollStrategy', 'RetryPolicy']
+
+class PollStrategy:
+    """How to poll the controller while waiting for it to report ready.
+
+    The first `spin` polls are sent back to back, after which the delay between
+    polls starts at `initialDelay` and is multiplied by `backoff` up to `maxDelay`.
+    Waiting gives up after `timeout` seconds or `maxAttempts` polls (None for no limit).
+    """
+
+    def __init__(self, spin=8, initialDelay=0.001, backoff=2.0, maxDelay=0.05, timeout=5.0, maxAttempts=None):
+        self.spin = spin
+        self.initialDelay = initialDelay
+        self.backoff = backoff
+        self.maxDelay = maxDelay
+        self.timeout = timeout
+        self.maxAttempts = maxAttempts
+
+    def delays(self):
+        """Yield the delay in seconds to wait before each poll"""
+        attempt = 0
+        delay = self.initialDelay
+        while self.maxAttempts is None or attempt < self.maxAttempts:
+            if attempt < self.spin:
+                yield 0
+            else:
+                yield delay
+                delay = min(delay * self.backoff, self.maxDelay)
+            attempt += 1
+
+    def __repr__(self):
+        return (f"PollStrategy(spin={self.spin}, initialDelay={self.initialDelay}, backoff={self.backoff}, "
+                f"maxDelay={self.maxDelay}, timeout={self.timeout}, maxAttempts={self.maxAttempts})")
+
+class RetryPolicy:
+    """How to retry a read or write whose checksum didn't match.
+
+    Up to `retries` retries are made per operation, the first after `initialDelay`
+    seconds, multiplied by `backoff` up to `maxDelay`, each shortened by a random
+    fraction of up to `jitter` so controllers on one hub don't retry in step. Every
+    retry also spends one unit of a `budget` shared by all users of the policy, which
+    each successful operation refills by `refill`; once it runs out operations fail
+    straight away rather than piling retries onto a bad link.
+    """
+
+    def __init__(self, retries=3, initialDelay=0.01, backoff=2.0, maxDelay=0.2, jitter=0.5, budget=10, refill=0.1):
+        self.retries = retries
+        self.initialDelay = initialDelay
+        self.backoff = backoff
+        self.maxDelay = maxDelay
+        self.jitter = jitter
+        self.budget = budget
+        self.refill = refill
+        self.available = budget
+        self._lock = threading.Lock()
+
+    def delays(self):
+        """Yield the delay in seconds to wait before each retry"""
+        delay = self.initialDelay
+        for _ in range(self.retries):
+            yield delay * (1 - self.jitter * random.random())
+            delay = min(delay * self.backoff, self.maxDelay)
+
+    def spend(self):
+        """Take one retry from the budget, returning False if it is used up"""
+        with self._lock:
+            if self.available < 1:
+                return False
+            self.available -= 1
+            return True
+
+    def succeeded(self):
+        if self.available >= self.budget:
+            return
+        with self._lock:
+            self.available = min(self.available + self.refill, self.budget)
+
+    def __repr__(self):
+        return (f"RetryPolicy(retries={self.retries}, initialDelay={self.initialDelay}, backoff={self.backoff}, "
+                f"maxDelay={self.maxDelay}, jitter={self.jitter}, budget={self.budget}, refill={self.refill})")
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import queue
+import random
+import struct
+import time
+
+__all__ = ['Simulator', 'SimulatedController', 'SimulatedDevice', 'factoryImage']
+
+# Factory configuration, as captured in wincontrols-hid-format.txt
+factoryImage = bytes.fromhex(
+    "5200510050004f00040005001b001c00"
+    "1a001600040007002c00280000000000"
+    "0000ea00eb00ec00ed00000000000000"
+    "0000e0000000000000001b0000000000"
+    "00000000000000000000000000000000"
+    "000000000000" "2c01" "000000000000" "2c01"
+).ljust(256, b'\0')
+
+class SimulatedController:
+    """Emulates the configuration interface of a single GPD Win controller."""
+
+    # (usage page, usage) of each HID interface: keyboard, configuration, mouse
+    interfaces = ((0x01, 0x06), (0xff00, 0x01), (0x01, 0x02))
+
+    def __init__(self, image=factoryImage, firmware=('X510', 'K504'), latency=0.0, notReady=0, serial='SIM0000', errorRate=0.0):
+        self.image = bytearray(image).ljust(256, b'\0')[:256]
+        self.firmware = firmware
+        self.latency = latency
+        self.notReady = notReady
+        self.serial = serial
+        # chance of corrupting each block read or written, as on a noisy link
+        self.errorRate = errorRate
+        self._random = random.Random(serial)
+        self.commits = 0
+        self._pending = bytearray(256)
+        self._reply = bytes(64)
+        self._last = None
+        self._wait = 0
+        # input reports waiting to be read, per interface
+        self.inputs = {interface: queue.Queue() for interface, _ in enumerate(self.interfaces)}
+
+    def _firmwareBytes(self):
+        return bytes(int(v[i:j], 16) for v in self.firmware for i, j in ((1, 2), (2, 4)))
+
+    def _status(self, ready, checksum=0):
+        reply = bytearray(64)
+        reply[8] = 0xaa if ready else 0
+        reply[9:13] = self._firmwareBytes()
+        struct.pack_into("<I", reply, 24, checksum & 0xffffffff)
+        return bytes(reply)
+
+    def _corrupt(self, block):
+        block = bytes(block)
+        if self.errorRate and self._random.random() < self.errorRate:
+            offset = self._random.randrange(len(block))
+            block = block[:offset] + bytes([block[offset] ^ 0x01]) + block[offset+1:]
+        return block
+
+    def request(self, data):
+        """Handle a 0x01 feature report sent by the host."""
+        if len(data) < 6 or data[0] != 0x01 or data[1] != 0xa5 or data[3] != 0x5a or data[2] ^ data[4] != 0xff:
+            raise RuntimeError(f"Malformed request: {bytes(data).hex()}")
+
+        id = data[2]
+        payload = data[6:]
+
+        if id in (0x10, 0x20):
+            if self._last != id:
+                self._wait = self.notReady
+                if id == 0x20:
+                    self._pending = bytearray(256)
+            if self._wait > 0:
+                self._wait -= 1
+                self._reply = self._status(False)
+            else:
+                self._reply = self._status(True)
+        elif id == 0x11:
+            addr = payload[0]
+            if addr > 3:
+                raise RuntimeError(f"Invalid read address {addr}")
+            self._reply = self._corrupt(self.image[addr<<6:(addr+1)<<6])
+        elif id == 0x12:
+            self._reply = self._status(True, sum(self.image))
+        elif id == 0x21:
+            index = struct.unpack_from("<H", payload)[0]
+            if index > 7:
+                raise RuntimeError(f"Invalid write block {index}")
+            self._pending[index<<4:(index+1)<<4] = self._corrupt(payload[2:18])
+        elif id == 0x22:
+            self._reply = self._status(True, sum(self._pending))
+        elif id == 0x23:
+            self.image[:] = self._pending
+            self.commits += 1
+        else:
+            raise RuntimeError(f"Unknown request 0x{id:02x}")
+
+        self._last = id
+
+    def reply(self, size):
+        """Return the input report queued by the last request."""
+        return self._reply[:size]
+
+    def input(self, interface, report):
+        """Queue an input report (e.g. a key press) to be read from an interface."""
+        self.inputs[interface].put(bytes(report))
+
+class SimulatedDevice:
+    """Stand-in for hid.Device connected to a SimulatedController."""
+
+    def __init__(self, controller, interface=1):
+        self.controller = controller
+        self.interface = interface
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def _delay(self):
+        if not self.controller:
+            raise RuntimeError("device closed")
+        if self.controller.latency:
+            time.sleep(self.controller.latency)
+
+    def send_feature_report(self, data):
+        self._delay()
+        self.controller.request(data)
+        return len(data)
+
+    def get_input_report(self, report_id, size):
+        self._delay()
+        return self.controller.reply(size)
+
+    def get_input_report_into(self, report_id, buffer):
+        self._delay()
+        reply = self.controller.reply(len(buffer))
+        buffer[:len(reply)] = reply
+        return len(reply)
+
+    def read(self, size, timeout=None):
+        if not self.controller:
+            raise RuntimeError("device closed")
+        try:
+            report = self.controller.inputs[self.interface].get(timeout=None if timeout is None else timeout / 1000)
+        except queue.Empty:
+            return b''
+        return report[:size]
+
+    def read_into(self, buffer, timeout=None):
+        report = self.read(len(buffer), timeout)
+        buffer[:len(report)] = report
+        return len(report)
+
+    def close(self):
+        self.controller = None
+
+class Simulator:
+    """Backend exposing simulated controllers through the enumerate()/Device() interface of the hid module."""
+
+    vid = 0x2f24
+    pid = 0x0135
+
+    def __init__(self, controllers=None, count=1, **options):
+        self.controllers = controllers or [SimulatedController(serial=f"SIM{i:04d}", **options) for i in range(count)]
+
+    def enumerate(self, vid=0, pid=0):
+        if vid not in (0, self.vid) or pid not in (0, self.pid):
+            return []
+
+        devices = []
+        for index, controller in enumerate(self.controllers):
+            for interface, (page, usage) in enumerate(controller.interfaces):
+                devices.append({
+                    'path': f"sim:{index}:{interface}".encode(),
+                    'vendor_id': self.vid,
+                    'product_id': self.pid,
+                    'serial_number': controller.serial,
+                    'release_number': 0x0100,
+                    'manufacturer_string': 'GPD (simulated)',
+                    'product_string': 'Simulated WinControls',
+                    'usage_page': page,
+                    'usage': usage,
+                    'interface_number': interface,
+                })
+        return devices
+
+    def Device(self, vid=None, pid=None, serial=None, path=None):
+        if path:
+            _, index, interface = path.split(b':')
+            return SimulatedDevice(self.controllers[int(index)], int(interface))
+        for controller in self.controllers:
+            if serial is None or controller.serial == serial:
+                return SimulatedDevice(controller)
+        raise RuntimeError("unable to open device")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import json
+import time
+
+__all__ = ['Tracer', 'Replay', 'ReplayDevice', 'readTrace']
+
+class Tracer:
+    """Records every WinControls request/reply as one JSON line.
+
+    Each line holds the time since tracing started and the transaction latency in
+    seconds, the opcode, and the request and reply (null for writes) as hex:
+        {"t": 0.0012, "op": 17, "req": "01a5115aee00...", "resp": "...", "latency": 0.0008}
+    Attach it by setting WinControls.tracer.
+    """
+
+    def __init__(self, file):
+        self._file = open(file, "w", buffering=1) if isinstance(file, str) else file
+        self._start = time.perf_counter()
+
+    def record(self, id, request, reply, start):
+        end = time.perf_counter()
+        self._file.write(json.dumps({
+            't': round(start - self._start, 6),
+            'op': id,
+            'req': request.hex(),
+            'resp': None if reply is None else reply.hex(),
+            'latency': round(end - start, 6),
+        }) + "\n")
+
+    def close(self):
+        self._file.close()
+
+def readTrace(file):
+    """Load the transactions recorded by a Tracer"""
+    with open(file) as rf:
+        return [json.loads(line) for line in rf if line.strip()]
+
+class ReplayDevice:
+    """Plays a recorded trace back in place of a real device."""
+
+    def __init__(self, transactions, strict=True, timing=False):
+        self.transactions = transactions
+        self.strict = strict
+        self.timing = timing
+        self.position = 0
+        self._reply = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def send_feature_report(self, data):
+        if self.position >= len(self.transactions):
+            raise RuntimeError("Replay ran past the end of the trace")
+        transaction = self.transactions[self.position]
+        self.position += 1
+
+        if self.strict and bytes(data).hex() != transaction['req']:
+            raise RuntimeError(f"Replay diverged at transaction {self.position}: "
+                               f"sent {bytes(data).hex()}, recorded {transaction['req']}")
+        if self.timing:
+            time.sleep(transaction['latency'])
+        self._reply = bytes.fromhex(transaction['resp'] or '')
+        return len(data)
+
+    def get_input_report(self, report_id, size):
+        return self._reply[:size]
+
+    def get_input_report_into(self, report_id, buffer):
+        reply = self._reply[:len(buffer)]
+        buffer[:len(reply)] = reply
+        return len(reply)
+
+    def close(self):
+        pass
+
+class Replay:
+    """Backend serving a trace recorded by Tracer back to WinControls.
+
+    With strict set every request must match the recording, and with timing set
+    each transaction takes as long as it originally did.
+    """
+
+    def __init__(self, file, strict=True, timing=False):
+        self.transactions = readTrace(file) if isinstance(file, str) else list(file)
+        self.strict = strict
+        self.timing = timing
+
+    def enumerate(self, vid=0, pid=0):
+        return [{
+            'path': b'replay:0',
+            'vendor_id': 0x2f24,
+            'product_id': 0x0135,
+            'serial_number': 'REPLAY',
+            'release_number': 0,
+            'manufacturer_string': 'GPD (replay)',
+            'product_string': 'Replayed WinControls',
+            'usage_page': 0xff00,
+            'usage': 0x01,
+            'interface_number': 0,
+        }]
+
+    def Device(self, vid=None, pid=None, serial=None, path=None):
+        return ReplayDevice(self.transactions, self.strict, self.timing)
@@ -0,0 +1,59 @@
+import asyncio
+
+from gpdconfig.wincontrols import WinControls
+from gpdconfig.wincontrols.aio import AsyncWinControls
+from gpdconfig.wincontrols.simulator import Simulator, factoryImage
+
+def openSlow(latency=0.01, notReady=0):
+    backend = Simulator(latency=latency, notReady=notReady)
+    return AsyncWinControls(WinControls(backend=backend)), backend.controllers[0]
+
+def test_cancelling_a_queued_call_leaves_the_running_one():
+    async def run():
+        # still polling for readiness when the write is cancelled
+        awc, controller = openSlow(notReady=10)
+        awc.wc.setConfig(["a=M"])
+        reading = asyncio.create_task(awc.readConfig())
+        writing = asyncio.create_task(awc.writeConfig(force=True))
+        await asyncio.sleep(0.05)
+        writing.cancel()
+        # the read finishes rather than being aborted, and the write never runs
+        await reading
+        try:
+            await writing
+        except asyncio.CancelledError:
+            pass
+        await awc.close()
+        return writing, controller
+
+    writing, controller = asyncio.run(run())
+    assert writing.cancelled()
+    assert controller.commits == 0
+
+def test_timeout_starts_when_the_call_runs():
+    async def run():
+        awc, controller = openSlow()
+        # each read takes about 0.12s, so the last queues for longer than its own timeout
+        first = [asyncio.create_task(awc.readConfig()) for _ in range(3)]
+        last = asyncio.create_task(awc.readConfig(timeout=0.3))
+        await asyncio.gather(*first)
+        await last
+        await awc.close()
+        return awc
+
+    assert asyncio.run(run()).wc.loaded
+
+def test_timed_out_write_is_not_committed():
+    async def run():
+        awc, controller = openSlow(0.05)
+        awc.wc.setConfig(["a=Z"])
+        try:
+            await awc.writeConfig(timeout=0.1)
+        except asyncio.TimeoutError:
+            pass
+        await awc.close()
+        return controller
+
+    controller = asyncio.run(run())
+    assert controller.commits == 0
+    assert bytes(controller.image) == factoryImage
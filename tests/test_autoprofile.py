@@ -0,0 +1,56 @@
+from gpdconfig.wincontrols import WinControls
+from gpdconfig.wincontrols.autoprofile import AutoProfile, ProfileRules
+from gpdconfig.wincontrols.compiler import compileProfile
+from gpdconfig.wincontrols.simulator import Simulator
+
+class FakeSource:
+    def __init__(self, *names):
+        self.names = list(names)
+
+    def snapshot(self):
+        return dict(enumerate(self.names))
+
+def makeAuto(backend, source):
+    game = ('game.txt', bytes(compileProfile(["a=M"])))
+    rules = ProfileRules([('game', *game)])
+    return AutoProfile(WinControls(backend=backend), rules, source, debounce=1.0), game
+
+def test_only_written_profiles_are_switches():
+    source = FakeSource("shell")
+    auto, game = makeAuto(Simulator(), source)
+    # the startup config is already on the controller
+    assert not auto.step(0)
+    assert not auto.step(2)
+    # the game is gone again before the debounce period ends
+    source.names = ["game"]
+    assert not auto.step(3)
+    source.names = ["shell"]
+    assert not auto.step(5)
+    assert auto.switches == 0
+
+    source.names = ["game"]
+    assert not auto.step(6)
+    assert auto.step(7)
+    assert auto.switches == 1
+
+def test_reopens_after_device_error():
+    backend = Simulator()
+    source = FakeSource("game")
+    auto, game = makeAuto(backend, source)
+    controller = backend.controllers[0]
+    request = controller.request
+
+    def unplugged(data):
+        raise OSError("No such device")
+
+    controller.request = unplugged
+    assert not auto.step(0)
+    assert not auto.step(1)
+    assert auto.stale
+
+    controller.request = request
+    assert not auto.step(1.5)
+    assert auto.step(2)
+    assert not auto.stale
+    assert controller.image[8] == 0x10
+    assert auto.switches == 1
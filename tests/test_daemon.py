@@ -0,0 +1,20 @@
+from gpdconfig.wincontrols import WinControls
+from gpdconfig.wincontrols.daemon import Dispatcher
+from gpdconfig.wincontrols.simulator import Simulator
+
+def test_set_sees_writes_from_other_processes():
+    backend = Simulator()
+    server = Dispatcher(WinControls(backend=backend))
+
+    other = WinControls(backend=backend)
+    other.setConfig(["a=Z"])
+    assert other.writeConfig()
+
+    reply = server.dispatch({'cmd': 'set', 'config': ["a=Z"]})
+    assert not reply['written']
+    assert reply['changes'] == []
+
+    reply = server.dispatch({'cmd': 'set', 'config': ["a=A"]})
+    assert reply['written']
+    assert reply['changes'] == [('a', 'Z', 'A')]
+    assert backend.controllers[0].commits == 2
@@ -0,0 +1,124 @@
+import time
+import socket
+
+import pytest
+
+from gpdconfig.wincontrols import hidraw
+from gpdconfig.wincontrols.hidraw import Hidraw, Device, parseDescriptor, HIDIOCSFEATURE, HIDIOCGFEATURE
+
+# usage page 0xff00, usage 1, application collection holding a nested one
+vendorDescriptor = bytes.fromhex("0600ff 0901 a101 0901 a100 c0 c0")
+# usage page 1 keyboard, then a mouse given as a 4-byte usage, with a long item between them
+keyboardMouseDescriptor = bytes.fromhex("0501 0906 a101 c0 fe0200aabb 0b02000100 a101 c0")
+
+def test_parse_top_level_collections():
+    assert parseDescriptor(vendorDescriptor) == [(0xff00, 0x01)]
+    assert parseDescriptor(keyboardMouseDescriptor) == [(0x01, 0x06), (0x01, 0x02)]
+
+def test_parse_empty_or_truncated():
+    assert parseDescriptor(b"") == []
+    assert parseDescriptor(bytes.fromhex("0600")) == []
+
+def makeNode(sysfs, name, hid_id, phys, descriptor=None, uniq="SER123"):
+    device = sysfs / name / "device"
+    device.mkdir(parents=True)
+    (device / "uevent").write_text(f"DRIVER=hid-generic\nHID_ID={hid_id}\nHID_NAME=GPD Controller\n"
+                                   f"HID_PHYS={phys}\nHID_UNIQ={uniq}\n")
+    if descriptor is not None:
+        (device / "report_descriptor").write_bytes(descriptor)
+
+def fakeTree(tmp_path):
+    sysfs = tmp_path / "sys"
+    makeNode(sysfs, "hidraw0", "0003:00002F24:00000135", "usb-0000:00:14.0-1/input0", keyboardMouseDescriptor)
+    makeNode(sysfs, "hidraw1", "0003:00002F24:00000135", "usb-0000:00:14.0-1/input1", vendorDescriptor)
+    makeNode(sysfs, "hidraw2", "0003:0000046D:0000C52B", "usb-0000:00:14.0-2/input0", vendorDescriptor)
+    makeNode(sysfs, "hidraw3", "0003:00002F24:00000135", "usb-0000:00:14.0-1/input2")
+    # a node whose uevent can't be parsed is skipped
+    (sysfs / "hidraw4" / "device").mkdir(parents=True)
+    return Hidraw(sysfs=str(sysfs), dev="/fake/dev")
+
+def test_enumerate(tmp_path):
+    devices = fakeTree(tmp_path).enumerate()
+    assert [(d['path'], d['usage_page'], d['usage'], d['interface_number']) for d in devices] == [
+        (b"/fake/dev/hidraw0", 0x01, 0x06, 0),
+        (b"/fake/dev/hidraw0", 0x01, 0x02, 0),
+        (b"/fake/dev/hidraw1", 0xff00, 0x01, 1),
+        (b"/fake/dev/hidraw2", 0xff00, 0x01, 0),
+        # no report descriptor
+        (b"/fake/dev/hidraw3", 0, 0, 2),
+    ]
+    assert devices[2]['vendor_id'] == 0x2f24
+    assert devices[2]['product_id'] == 0x0135
+    assert devices[2]['serial_number'] == "SER123"
+    assert devices[2]['product_string'] == "GPD Controller"
+
+def test_enumerate_by_id(tmp_path):
+    backend = fakeTree(tmp_path)
+    assert {d['path'] for d in backend.enumerate(0x2f24, 0x0135)} == {b"/fake/dev/hidraw0", b"/fake/dev/hidraw1", b"/fake/dev/hidraw3"}
+    assert [d['path'] for d in backend.enumerate(0x046d)] == [b"/fake/dev/hidraw2"]
+    assert backend.enumerate(0x2f24, 0x0001) == []
+
+def test_enumerate_without_sysfs(tmp_path):
+    assert Hidraw(sysfs=str(tmp_path / "missing")).enumerate() == []
+
+@pytest.fixture
+def pseudoDevice():
+    """A Device on one end of a packet socketpair standing in for /dev/hidrawN, and the other end"""
+    ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    device = Device(fd=ours.detach())
+    yield device, theirs
+    device.close()
+    theirs.close()
+
+def test_device_reads_reports(pseudoDevice):
+    device, peer = pseudoDevice
+    peer.send(b"\x01first")
+    peer.send(b"\x01second")
+    assert device.read(64) == b"\x01first"
+    buffer = bytearray(64)
+    assert device.read_into(buffer) == 7
+    assert buffer[:7] == b"\x01second"
+
+def test_device_write(pseudoDevice):
+    device, peer = pseudoDevice
+    assert device.write(b"\x00report") == 7
+    assert peer.recv(64) == b"\x00report"
+
+def test_device_read_timeout(pseudoDevice):
+    device, peer = pseudoDevice
+    start = time.monotonic()
+    assert device.read(64, timeout=50) == b""
+    assert device.read_into(bytearray(64), timeout=0) == 0
+    assert time.monotonic() - start >= 0.04
+    peer.send(b"\x01late")
+    assert device.read(64, timeout=50) == b"\x01late"
+
+def test_device_nonblocking(pseudoDevice):
+    device, peer = pseudoDevice
+    device.nonblocking = 1
+    assert device.nonblocking
+    assert device.read(64) == b""
+    peer.send(b"\x01now")
+    assert device.read(64) == b"\x01now"
+
+def test_device_feature_reports(pseudoDevice, monkeypatch):
+    device, peer = pseudoDevice
+    calls = []
+
+    def ioctl(fd, request, buffer, mutate):
+        calls.append((request, bytes(buffer)))
+        if request == HIDIOCGFEATURE(len(buffer)):
+            buffer[1:4] = b"abc"
+            return 4
+        return len(buffer)
+
+    monkeypatch.setattr(hidraw.fcntl, 'ioctl', ioctl)
+    assert device.send_feature_report(b"\x01\xa5\x10") == 3
+    assert device.get_feature_report(0x01, 8) == b"\x01abc"
+    assert calls == [(HIDIOCSFEATURE(3), b"\x01\xa5\x10"), (HIDIOCGFEATURE(8), b"\x01" + bytes(7))]
+
+def test_closed_device(pseudoDevice):
+    device, peer = pseudoDevice
+    device.close()
+    with pytest.raises(OSError):
+        device.send_feature_report(b"\x01")
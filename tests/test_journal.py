@@ -0,0 +1,81 @@
+import datetime
+
+import pytest
+
+from gpdconfig.wincontrols.journal import Journal
+
+def stamp(text):
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = Journal(str(tmp_path / "state" / "journal"), capacity=8)
+    info = {'Xfirmware': 'X510', 'Kfirmware': 'K504'}
+    # three writes to SIM0000 and one to SIM0001 in between
+    journal.append("SIM0000", bytes([1]) * 256, info, stamp("2024-05-01T10:00"))
+    journal.append("SIM0001", bytes([2]) * 256, info, stamp("2024-05-01T11:00"))
+    journal.append("SIM0000", bytes([3]) * 256, info, stamp("2024-05-01T12:00"))
+    journal.append("SIM0000", bytes([4]) * 256, info, stamp("2024-05-01T13:00"))
+    yield journal
+    journal.close()
+
+def test_select_by_sequence_number(journal):
+    assert journal.select("0", "SIM0000")['image'] == bytes([1]) * 256
+    assert journal.select(3, "SIM0000")['image'] == bytes([4]) * 256
+    with pytest.raises(RuntimeError, match="is for controller SIM0001"):
+        journal.select("1", "SIM0000")
+    with pytest.raises(RuntimeError, match="No journal entry 9"):
+        journal.select("9", "SIM0000")
+
+def test_select_relative(journal):
+    # SIM0001's entry in between doesn't count
+    assert journal.select("-1", "SIM0000")['seq'] == 2
+    assert journal.select("-2", "SIM0000")['seq'] == 0
+    with pytest.raises(RuntimeError, match="fewer than 4 entries"):
+        journal.select("-3", "SIM0000")
+
+def test_select_by_time(journal):
+    assert journal.select("2024-05-01T12:00", "SIM0000")['seq'] == 2
+    assert journal.select("2024-05-01T12:59", "SIM0000")['seq'] == 2
+    assert journal.select("2024-05-01T11:30", "SIM0000")['seq'] == 0
+    assert journal.select("2024-05-02", "SIM0001")['seq'] == 1
+    with pytest.raises(RuntimeError, match="at or before"):
+        journal.select("2024-05-01T09:00", "SIM0000")
+    with pytest.raises(RuntimeError, match="Invalid journal reference"):
+        journal.select("yesterday", "SIM0000")
+
+def test_select_checks_firmware(journal):
+    assert journal.select("0", "SIM0000", "X510K504")['seq'] == 0
+    with pytest.raises(RuntimeError, match="firmware X510K504"):
+        journal.select("0", "SIM0000", "X510K407")
+
+def test_ring_keeps_latest(journal):
+    for i in range(10):
+        journal.append("SIM0000", bytes([i]) * 256, None)
+    assert journal.span() == (6, 14)
+    assert journal.get(5) is None
+    with pytest.raises(RuntimeError, match="No journal entry 0"):
+        journal.select("0", "SIM0000")
+
+def test_committed_image_journalled_when_readback_fails(tmp_path):
+    from gpdconfig.wincontrols import WinControls
+    from gpdconfig.wincontrols.simulator import Simulator
+
+    journal = Journal(str(tmp_path / "journal"))
+    backend = Simulator()
+    wc = WinControls(backend=backend, journal=journal)
+    controller = backend.controllers[0]
+    wc.setConfig(["a=M"])
+    request = controller.request
+
+    def corruptAfterCommit(data):
+        request(data)
+        if data[2] == 0x23:
+            # every block read back is corrupted
+            controller.errorRate = 1.0
+
+    controller.request = corruptAfterCommit
+    with pytest.raises(RuntimeError, match="reading back"):
+        wc.writeConfig(verify='readback')
+    assert controller.commits == 1
+    assert [entry['image'] for entry in journal.entries()] == [bytes(controller.image)]
@@ -0,0 +1,28 @@
+import pytest
+
+from gpdconfig.wincontrols.compiler import compileProfile
+from gpdconfig.wincontrols.library import ProfileStore
+
+def test_profiles_are_compiled_by_name(tmp_path):
+    (tmp_path / "profiles").mkdir()
+    (tmp_path / "profiles" / "game.txt").write_text("a=M\n")
+    store = ProfileStore(str(tmp_path / "profiles"), str(tmp_path / "cache"))
+    assert store.names() == ["game"]
+    assert store.image("game") == bytes(compileProfile(["a=M"]))
+
+def test_names_shared_by_several_files_are_errors(tmp_path):
+    profiles = tmp_path / "profiles"
+    profiles.mkdir()
+    (profiles / "game.txt").write_text("a=M\n")
+    store = ProfileStore(str(profiles), str(tmp_path / "cache"))
+    (profiles / "game.bin").write_bytes(bytes(256))
+    store.refresh()
+    assert store.names() == []
+    assert store.errors == {"game": "several files are named 'game': game.bin, game.txt"}
+    with pytest.raises(RuntimeError, match="can't be used: several files"):
+        store.image("game")
+
+    (profiles / "game.bin").unlink()
+    store.refresh()
+    assert store.names() == ["game"]
+    assert store.errors == {}
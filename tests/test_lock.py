@@ -0,0 +1,31 @@
+import threading
+
+import pytest
+
+from gpdconfig.wincontrols.lock import DeviceLock
+
+def test_contended_counts_acquisitions_that_waited(tmp_path):
+    holder = DeviceLock("2f24:0135:SER", directory=str(tmp_path))
+    waiter = DeviceLock("2f24:0135:SER", timeout=0.05, directory=str(tmp_path))
+    held, done = threading.Event(), threading.Event()
+
+    def hold():
+        with holder:
+            held.set()
+            done.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    with pytest.raises(RuntimeError, match="Controller is busy"):
+        waiter.acquire()
+    assert waiter.stats()['contended'] == 0
+
+    waiter.timeout = 5
+    threading.Timer(0.05, done.set).start()
+    with waiter:
+        pass
+    thread.join()
+    assert waiter.stats()['acquisitions'] == 1
+    assert waiter.stats()['contended'] == 1
+    assert waiter.stats()['lastHolder'] is not None
@@ -0,0 +1,73 @@
+import pytest
+
+from gpdconfig.wincontrols import WinControls
+from gpdconfig.wincontrols.polling import RetryPolicy
+from gpdconfig.wincontrols.simulator import Simulator, SimulatedController, factoryImage
+
+class FlakyController(SimulatedController):
+    """Corrupts the first `failures` blocks read or written, then behaves"""
+
+    def __init__(self, failures, **options):
+        super().__init__(**options)
+        self.failures = failures
+
+    def _corrupt(self, block):
+        block = bytes(block)
+        if self.failures:
+            self.failures -= 1
+            return bytes([block[0] ^ 0x01]) + block[1:]
+        return block
+
+def openSimulated(controller=None, retries=3):
+    backend = Simulator([controller or SimulatedController()])
+    return WinControls(backend=backend, retry=RetryPolicy(retries=retries, initialDelay=0)), backend.controllers[0]
+
+def test_read():
+    wc, controller = openSimulated()
+    assert wc.loaded
+    assert bytes(wc._configRaw) == factoryImage
+    assert wc.config['a'] == 'A'
+    assert wc.config['l4delay4'] == 300
+    assert wc.info['Kfirmware'] == 'K504'
+
+def test_write():
+    wc, controller = openSimulated()
+    wc.setConfig(["a=M", "rumble=1"])
+    assert wc.writeConfig()
+    assert controller.commits == 1
+
+    reread, _ = openSimulated(controller)
+    assert reread.config['a'] == 'M'
+    assert reread.config['rumble'] == 1
+    assert reread.config['b'] == 'B'
+
+def test_unchanged_write_is_skipped():
+    wc, controller = openSimulated()
+    wc.setConfig(["a=A"])
+    assert not wc.writeConfig()
+    assert controller.commits == 0
+
+    assert wc.writeConfig(force=True)
+    assert controller.commits == 1
+
+def test_read_retried_after_checksum_error():
+    wc, controller = openSimulated(FlakyController(1))
+    assert controller.failures == 0
+    assert bytes(wc._configRaw) == factoryImage
+
+def test_write_retried_after_checksum_error():
+    wc, controller = openSimulated(FlakyController(0))
+    controller.failures = 1
+    wc.setConfig(["a=M"])
+    assert wc.writeConfig()
+    assert controller.commits == 1
+    assert openSimulated(controller)[0].config['a'] == 'M'
+
+def test_write_not_committed_when_retries_run_out():
+    wc, controller = openSimulated(FlakyController(0), retries=2)
+    controller.failures = 100
+    wc.setConfig(["a=M"])
+    with pytest.raises(RuntimeError, match="Checksum error writing config after 3 attempts"):
+        wc.writeConfig()
+    assert controller.commits == 0
+    assert bytes(controller.image) == factoryImage